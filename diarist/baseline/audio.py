@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import torch
+
+from diarist.wavfile import WavFile
+
+
+def load_audio(in_wav):
+    """load a 16 kHz mono audio file once into a (1, T) tensor
+
+    16-bit PCM wav files are memory-mapped as int16, so only the regions
+    that are used are read from disk; other files are decoded into float32.
+    VAD, speaker embedding and ST all work on views of this buffer, converted
+    with `to_float32` where the samples are needed. `in_wav` may also be a
+    mini-session of a `DiariSTDataset`, which is synthesized instead.
+    """
+    if not isinstance(in_wav, str):
+        return in_wav.load()
+
+    try:
+        wav = WavFile(in_wav)
+    except ValueError:
+        wav = None
+    if wav is not None and wav.dtype == np.int16:
+        assert wav.sample_rate == 16000
+        assert wav.num_channels == 1
+        return torch.from_numpy(wav.samples.T), wav.sample_rate
+
+    import torchaudio
+
+    audio, sr = torchaudio.load(in_wav)
+    assert sr == 16000
+    assert audio.shape[0] == 1
+    return audio.float().contiguous(), sr
+
+
+def to_float32(audio):
+    """float32 samples of (a view of) a `load_audio` buffer, as torchaudio.load gives"""
+    if audio.dtype == torch.int16:
+        return audio.float() / 32768.0
+    return audio
+
+
+def _speech_prob(vad_model, audio, large_chunk_size=30, small_chunk_size=10):
+    """frame-level speech probabilities of an in-memory signal
+
+    Same as `VAD.get_speech_prob_file` (without overlapping small chunks),
+    but the large chunks are views of `audio` instead of reads of the file.
+    """
+    sample_rate = vad_model.sample_rate
+    time_resolution = vad_model.time_resolution
+    audio_len = audio.shape[-1]
+    long_chunk_len = int(sample_rate * large_chunk_size)
+    small_chunk_len = int(sample_rate * small_chunk_size)
+
+    prob_chunks = []
+    begin_sample = 0
+    while True:
+        last_chunk = begin_sample + long_chunk_len >= audio_len
+        large_chunk = audio[:, begin_sample : begin_sample + long_chunk_len]
+        large_chunk = to_float32(large_chunk).to(vad_model.device)
+        if last_chunk or large_chunk.shape[-1] < small_chunk_len:
+            padding = torch.zeros(1, small_chunk_len, device=large_chunk.device)
+            large_chunk = torch.cat([large_chunk, padding], dim=1)
+
+        small_chunks = torch.nn.functional.unfold(
+            large_chunk.unsqueeze(1).unsqueeze(2),
+            kernel_size=(1, small_chunk_len),
+            stride=(1, small_chunk_len),
+        )
+        small_chunks = small_chunks.squeeze(0).transpose(0, 1)
+        small_chunks_prob = vad_model.get_speech_prob_chunk(small_chunks)
+        small_chunks_prob = small_chunks_prob[:, :-1, :]
+
+        small_chunks_prob = small_chunks_prob.permute(2, 1, 0)
+        out_len = int(large_chunk.shape[-1] / (sample_rate * time_resolution))
+        kernel_len = int(small_chunk_size / time_resolution)
+        small_chunks_prob = torch.nn.functional.fold(
+            small_chunks_prob,
+            output_size=(1, out_len),
+            kernel_size=(1, kernel_len),
+            stride=(1, kernel_len),
+        )
+        prob_chunks.append(small_chunks_prob.squeeze(1).transpose(-1, -2))
+
+        if last_chunk:
+            break
+        begin_sample = begin_sample + long_chunk_len
+
+    prob_vad = torch.cat(prob_chunks, dim=1)
+    last_elem = int(audio_len / (time_resolution * sample_rate))
+    return prob_vad[:, 0:last_elem, :]
+
+
+def get_speech_segments(
+    vad_model,
+    audio,
+    close_th=0.250,
+    len_th=0.250,
+    activation_th=0.5,
+    deactivation_th=0.25,
+    speech_th=0.50,
+):
+    """speech boundaries of an in-memory signal
+
+    Same as `vad_model.get_speech_segments(in_wav)` with its default options,
+    which reads the file twice: once for the speech probabilities and once
+    more for double-checking every candidate segment.
+    """
+    prob_chunks = _speech_prob(vad_model, audio)
+    prob_th = vad_model.apply_threshold(
+        prob_chunks, activation_th=activation_th, deactivation_th=deactivation_th
+    ).float()
+    boundaries = vad_model.get_boundaries(prob_th, output_value="seconds")
+    boundaries = vad_model.merge_close_segments(boundaries, close_th=close_th)
+    boundaries = vad_model.remove_short_segments(boundaries, len_th=len_th)
+
+    # double check speech segments
+    sample_rate = vad_model.sample_rate
+    new_boundaries = []
+    for i in range(boundaries.shape[0]):
+        beg_sample = int(boundaries[i, 0] * sample_rate)
+        end_sample = int(boundaries[i, 1] * sample_rate)
+        segment = to_float32(audio[:, beg_sample:end_sample])
+        speech_prob = vad_model.get_speech_prob_chunk(segment)
+        if speech_prob.mean() > speech_th:
+            new_boundaries.append([boundaries[i, 0], boundaries[i, 1]])
+    return torch.FloatTensor(new_boundaries).to(boundaries.device)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+import os
+import json
+
+# torch and the model stacks are imported by the functions that use them,
+# so that the backend names can be checked without loading them
+SPK_MODEL_SOURCE = "speechbrain/spkrec-ecapa-voxceleb"
+VAD_MODEL_SOURCE = "speechbrain/vad-crdnn-libriparty"
+# written by diarist_snapshot into the model directory
+SNAPSHOT_INFO = "snapshot.json"
+
+ST_BACKENDS = {}
+SPK_BACKENDS = {}
+# ST backends that run on CPU whatever the device
+CPU_ONLY_ST_BACKENDS = set()
+
+
+def register_st_backend(name, cpu_only=False):
+    """register `load_fn(st_model_size, device, model_dir)` as an ST backend"""
+
+    def register(load_fn):
+        ST_BACKENDS[name] = load_fn
+        if cpu_only:
+            CPU_ONLY_ST_BACKENDS.add(name)
+        return load_fn
+
+    return register
+
+
+def register_spk_backend(name):
+    """register `load_fn(device, model_dir)` as a speaker embedding backend"""
+
+    def register(load_fn):
+        SPK_BACKENDS[name] = load_fn
+        return load_fn
+
+    return register
+
+
+def check_backends(st_backend="whisper", spk_backend="ecapa"):
+    """raise ValueError for unknown backend names"""
+    if st_backend not in ST_BACKENDS:
+        raise ValueError(f"Unknown ST backend {st_backend}")
+    if spk_backend not in SPK_BACKENDS:
+        raise ValueError(f"Unknown speaker backend {spk_backend}")
+
+
+def load_st_backend(st_backend, st_model_size, device, model_dir=""):
+    check_backends(st_backend=st_backend)
+    return ST_BACKENDS[st_backend](st_model_size, device, model_dir)
+
+
+def load_spk_backend(spk_backend, device, model_dir=""):
+    check_backends(spk_backend=spk_backend)
+    return SPK_BACKENDS[spk_backend](device, model_dir)
+
+
+def st_fp16(st_backend="whisper"):
+    """whether an ST backend decodes in fp16 here, i.e. runs on GPU"""
+    import torch
+
+    return torch.cuda.is_available() and st_backend not in CPU_ONLY_ST_BACKENDS
+
+
+def spk_model_id(spk_backend="ecapa"):
+    """identity of a speaker backend in the embedding cache"""
+    if spk_backend == "ecapa":
+        return SPK_MODEL_SOURCE
+    return f"{SPK_MODEL_SOURCE}-{spk_backend}"
+
+
+def whisper_snapshot(model_dir, st_model_size):
+    """path of a whisper model saved by diarist_snapshot"""
+    return os.path.join(model_dir, f"whisper-{st_model_size}.pt")
+
+
+def speechbrain_snapshot(model_dir, source):
+    """directory of a SpeechBrain model saved by diarist_snapshot"""
+    return os.path.join(model_dir, source.split("/")[-1])
+
+
+def load_whisper_model(st_model_size, device, model_dir=""):
+    """`whisper.load_model`, or the model saved by diarist_snapshot in `model_dir`
+
+    The snapshot is the pickled model, so its weights are memory-mapped
+    instead of being randomly initialized and then overwritten, and the
+    checksum of the downloaded checkpoint is skipped. Workers loading it on
+    CPU share the pages of the file.
+    """
+    import torch
+    import whisper
+
+    if model_dir == "":
+        return whisper.load_model(st_model_size, device=device)
+    path = whisper_snapshot(model_dir, st_model_size)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found, run diarist_snapshot first")
+    with open(os.path.join(model_dir, SNAPSHOT_INFO)) as f:
+        version = json.load(f)[os.path.basename(path)]["whisper"]
+    if version != whisper.__version__:
+        raise ValueError(
+            f"{path} was saved with whisper {version}, run diarist_snapshot again"
+        )
+    st_model = torch.load(path, map_location="cpu", mmap=True, weights_only=False)
+    return st_model.to(device)
+
+
+def load_speechbrain(cls, source, model_dir="", **kwargs):
+    """`cls.from_hparams` of a hub model, or of its copy saved by diarist_snapshot"""
+    if model_dir == "":
+        return cls.from_hparams(source=source, **kwargs)
+    savedir = speechbrain_snapshot(model_dir, source)
+    if not os.path.exists(os.path.join(savedir, "hyperparams.yaml")):
+        raise FileNotFoundError(f"{savedir} not found, run diarist_snapshot first")
+    # all files are found in savedir, so nothing is resolved on the hub
+    return cls.from_hparams(source=savedir, savedir=savedir, **kwargs)
+
+
+def load_vad(model_dir=""):
+    """SpeechBrain's `VAD`, on CPU"""
+    from speechbrain.pretrained import VAD
+
+    return load_speechbrain(VAD, VAD_MODEL_SOURCE, model_dir)
+
+
+@register_st_backend("whisper")
+def load_whisper(st_model_size, device, model_dir=""):
+    """the original whisper, fp32 on CPU and fp16 on GPU"""
+    return load_whisper_model(st_model_size, device, model_dir)
+
+
+def _plain_linear(module):
+    # quantize_dynamic only swaps exact nn.Linear modules, not whisper's
+    # subclass, which merely casts the weights to the input dtype
+    import torch
+
+    for name, child in module.named_children():
+        if isinstance(child, torch.nn.Linear) and type(child) is not torch.nn.Linear:
+            linear = torch.nn.Linear(
+                child.in_features, child.out_features, bias=child.bias is not None
+            )
+            linear.load_state_dict(child.state_dict())
+            setattr(module, name, linear)
+        else:
+            _plain_linear(child)
+    return module
+
+
+@register_st_backend("whisper-int8", cpu_only=True)
+def load_whisper_int8(st_model_size, device, model_dir=""):
+    """whisper with int8 dynamically quantized linear layers, always on CPU
+
+    The encoder and decoder layers take a quarter of the memory and are
+    expected to run faster on CPU, while the output token projection stays
+    in fp32. The translations are not identical to the fp32 ones. Neither
+    the speed nor the SAtBLEU has been validated on the dev set yet.
+    """
+    import torch
+
+    st_model = _plain_linear(load_whisper_model(st_model_size, "cpu", model_dir))
+    return torch.ao.quantization.quantize_dynamic(
+        st_model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+@register_spk_backend("ecapa")
+def load_ecapa(device, model_dir=""):
+    """SpeechBrain's `EncoderClassifier`"""
+    from speechbrain.pretrained import EncoderClassifier
+
+    return load_speechbrain(
+        EncoderClassifier, SPK_MODEL_SOURCE, model_dir, run_opts={"device": device}
+    )
+
+
+@register_spk_backend("ecapa-jit")
+def load_ecapa_jit(device, model_dir=""):
+    """`EncoderClassifier` traced with TorchScript and frozen, same embeddings
+
+    The speed-up over `ecapa` has not been validated on the dev set yet.
+    """
+    from diarist.baseline.ecapa_jit import TracedSpeakerModel
+
+    return TracedSpeakerModel(load_ecapa(device, model_dir))
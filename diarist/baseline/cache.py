@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+
+import numpy as np
+import torch
+
+from diarist.baseline.utils import embed_frames
+
+CACHE_VERSION = 1
+
+_hashes = {}
+
+
+def audio_hash(in_wav):
+    """sha1 of an audio file, computed once per file version in a process"""
+    if not isinstance(in_wav, str):
+        # a DiariSTDataset mini-session
+        return in_wav.audio_hash()
+    st = os.stat(in_wav)
+    key = (os.path.abspath(in_wav), st.st_size, st.st_mtime_ns)
+    if key not in _hashes:
+        sha1 = hashlib.sha1()
+        with open(in_wav, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(chunk)
+        _hashes[key] = sha1.hexdigest()
+    return _hashes[key]
+
+
+def _save_npy(path, array):
+    tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def _save_json(path, obj):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+class EmbeddingCache:
+    """on-disk store of speaker embeddings
+
+    Entries are keyed by the audio content hash, the speaker model and the
+    exact frames the embeddings are extracted from, which covers the window
+    and `min_dur` settings as well as the VAD or ST segments they are applied
+    to. Each entry is a (num_frames, dim) float32 .npy file that is
+    memory-mapped when read, so clustering sweeps skip the speaker model.
+    """
+
+    def __init__(self, cache_dir, model_id):
+        self.cache_dir = cache_dir
+        self.model_id = model_id
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, in_wav, frames):
+        frames_hash = hashlib.sha1(np.asarray(frames, dtype=np.int64).tobytes())
+        key = hashlib.sha1(
+            f"v{CACHE_VERSION}|{audio_hash(in_wav)}|{self.model_id}|"
+            f"{frames_hash.hexdigest()}".encode()
+        ).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def get(self, in_wav, frames):
+        path = self.path(in_wav, frames)
+        if not os.path.exists(path):
+            return None
+        # copy-on-write, so the tensor shares the pages of the file
+        embeddings = np.load(path, mmap_mode="c")
+        if embeddings.shape[0] != len(frames):
+            return None
+        return torch.from_numpy(embeddings)
+
+    def put(self, in_wav, frames, embeddings):
+        _save_npy(
+            self.path(in_wav, frames),
+            embeddings.detach().cpu().numpy().astype(np.float32),
+        )
+
+
+def cached_embed_frames(
+    spk_model, audio, frames, in_wav, batch_size=64, emb_cache=None
+):
+    """stacked `embed_frames` output, read from and written to `emb_cache` if given"""
+    if emb_cache is not None:
+        stacked_embedding = emb_cache.get(in_wav, frames)
+        if stacked_embedding is not None:
+            return stacked_embedding.to(spk_model.device)
+    emb_list = embed_frames(spk_model, audio, frames, batch_size=batch_size)
+    stacked_embedding = torch.stack(emb_list)
+    if emb_cache is not None:
+        emb_cache.put(in_wav, frames, stacked_embedding)
+    return stacked_embedding
+
+
+class TranslationCache:
+    """on-disk store of whole-file speech translation results
+
+    Entries are keyed by the audio content hash, the ST model (e.g. whisper
+    version and model size) and the decode options, including the task. Only
+    the fields used by the baselines are kept: the text, the language and
+    the start, end and text of every segment.
+    """
+
+    def __init__(self, cache_dir, model_id):
+        self.cache_dir = cache_dir
+        self.model_id = model_id
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, in_wav, decode_options):
+        key = hashlib.sha1(
+            f"v{CACHE_VERSION}|{audio_hash(in_wav)}|{self.model_id}|"
+            f"{json.dumps(decode_options, sort_keys=True)}".encode()
+        ).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, in_wav, decode_options):
+        path = self.path(in_wav, decode_options)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def put(self, in_wav, decode_options, st_result):
+        _save_json(
+            self.path(in_wav, decode_options),
+            {
+                "text": st_result["text"],
+                "language": st_result.get("language"),
+                "segments": [
+                    {"start": seg["start"], "end": seg["end"], "text": seg["text"]}
+                    for seg in st_result["segments"]
+                ],
+            },
+        )
+
+
+def cached_transcribe(st_model, in_wav, decode_options, st_cache=None, audio=None):
+    """`st_model.transcribe` result, read from and written to `st_cache` if given
+
+    `audio` is the decoded signal of `in_wav`, decoded again by whisper if not
+    given.
+    """
+    if st_cache is not None:
+        st_result = st_cache.get(in_wav, decode_options)
+        if st_result is not None:
+            return st_result
+    st_result = st_model.transcribe(
+        in_wav if audio is None else audio, **decode_options
+    )
+    if st_cache is not None:
+        st_cache.put(in_wav, decode_options, st_result)
+    return st_result
@@ -1,11 +1,32 @@
 #!/usr/bin/env python3
 
-from nemo.collections.asr.parts.utils.offline_clustering import (
-    NMESC,
-    getCosAffinityMatrix,
-    getAffinityGraphMat,
-    SpectralClustering,
-)
+import torch
+
+
+def compress_embeddings(embeddings, num_anchors, num_iters=10):
+    """compress embeddings into at most `num_anchors` anchors with spherical k-means
+
+    The anchors start from embeddings evenly spaced in time. Returns the
+    anchor embeddings (the normalized centroids of the non-empty clusters)
+    and the anchor index of every embedding. Memory grows linearly with the
+    number of embeddings.
+    """
+    emb = torch.nn.functional.normalize(embeddings.float(), dim=1)
+    init = torch.linspace(0, emb.shape[0] - 1, num_anchors, device=emb.device)
+    anchors = emb[init.long()]
+    for _ in range(num_iters):
+        assign = torch.argmax(emb @ anchors.T, dim=1)
+        centroids = torch.zeros_like(anchors).index_add_(0, assign, emb)
+        # keep the previous anchor for empty clusters
+        empty = centroids.norm(dim=1) == 0
+        centroids[empty] = anchors[empty]
+        anchors = torch.nn.functional.normalize(centroids, dim=1)
+    assign = torch.argmax(emb @ anchors.T, dim=1)
+
+    _, assign = torch.unique(assign, return_inverse=True)
+    anchors = torch.zeros(int(assign.max()) + 1, emb.shape[1], device=emb.device)
+    anchors.index_add_(0, assign, emb)
+    return torch.nn.functional.normalize(anchors, dim=1), assign
 
 
 def clustering(
@@ -18,8 +39,39 @@ def clustering(
     fixed_thres=-1.0,
     nme_mat_size=300,
     cuda=False,
+    max_num_anchors=0,
 ):
-    """NMESC-based clustering"""
+    """NMESC-based clustering
+
+    With `max_num_anchors` > 0, longer inputs are first compressed into
+    anchors by `compress_embeddings`, the anchors are clustered and every
+    embedding takes the label of its anchor. This bounds the affinity matrix
+    and the eigendecompositions to the number of anchors for long recordings.
+    """
+    if max_num_anchors > 0 and embeddings.shape[0] > max_num_anchors:
+        anchors, assign = compress_embeddings(embeddings, max_num_anchors)
+        Y = clustering(
+            anchors,
+            num_speakers=num_speakers,
+            max_num_speakers=max_num_speakers,
+            max_rp_threshold=max_rp_threshold,
+            sparse_search=sparse_search,
+            sparse_search_volume=sparse_search_volume,
+            fixed_thres=fixed_thres,
+            nme_mat_size=nme_mat_size,
+            cuda=cuda,
+        )
+        if isinstance(Y, list):
+            return [Y[a] for a in assign.tolist()]
+        return Y[assign.to(Y.device)]
+
+    from nemo.collections.asr.parts.utils.offline_clustering import (
+        NMESC,
+        getCosAffinityMatrix,
+        getAffinityGraphMat,
+        SpectralClustering,
+    )
+
     mat = getCosAffinityMatrix(embeddings)
     nmesc = NMESC(
         mat,
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import time
+
+import fire
+import numpy as np
+import torch
+from scipy.optimize import linear_sum_assignment
+
+from diarist.baseline.clustering import clustering
+from diarist.baseline.online_clustering import OnlineClustering
+
+
+def label_agreement(labels_a, labels_b):
+    """fraction of items with the same label under the best one-to-one label mapping"""
+    _, a = np.unique(np.asarray(labels_a), return_inverse=True)
+    _, b = np.unique(np.asarray(labels_b), return_inverse=True)
+    confusion = np.zeros((a.max() + 1, b.max() + 1), dtype=np.int64)
+    np.add.at(confusion, (a, b), 1)
+    rows, cols = linear_sum_assignment(-confusion)
+    return confusion[rows, cols].sum() / len(a)
+
+
+def _run(embeddings, **kwargs):
+    torch.manual_seed(777)
+    torch.cuda.manual_seed(777)
+    start = time.time()
+    labels = clustering(embeddings, **kwargs)
+    labels = [int(y) for y in labels]
+    return labels, time.time() - start
+
+
+def _run_online(embeddings, **kwargs):
+    torch.manual_seed(777)
+    torch.cuda.manual_seed(777)
+    clusterer = OnlineClustering(**kwargs)
+    emitted, latency = [], []
+    for emb in embeddings:
+        start = time.time()
+        emitted.append(clusterer.add(emb))
+        latency.append(time.time() - start)
+    return clusterer.labels().tolist(), emitted, latency
+
+
+def clustering_agreement_main(
+    emb_cache_dir,
+    method="anchors",
+    max_num_anchors=100,
+    num_speakers=-1,
+    max_num_speakers=6,
+    max_num_centroids=64,
+    centroid_threshold=0.5,
+    speaker_threshold=0.4,
+    recluster_interval=50,
+):
+    """compare anchor-based or online clustering with the exact path
+
+    Runs both on every entry of an embedding cache written by the baselines
+    with `--emb_cache_dir`, and reports the label agreement, the estimated
+    number of speakers and the clustering time. With `method="online"`, the
+    agreement of the labels emitted at each step and the per-step latency are
+    reported as well.
+    """
+    if method not in ["anchors", "online"]:
+        raise ValueError(f"Unknown method {method}.")
+    emb_files = sorted(glob.glob(os.path.join(emb_cache_dir, "*.npy")))
+    print(f"Found {len(emb_files)} files in {emb_cache_dir}")
+
+    kwargs = {"num_speakers": num_speakers, "max_num_speakers": max_num_speakers}
+    online_kwargs = {
+        "max_num_centroids": max_num_centroids,
+        "centroid_threshold": centroid_threshold,
+        "speaker_threshold": speaker_threshold,
+        "recluster_interval": recluster_interval,
+    }
+    total, agreed, emitted_agreed, same_count = 0, 0.0, 0.0, 0
+    exact_time, other_time = 0.0, 0.0
+    latencies = []
+    for emb_file in emb_files:
+        embeddings = torch.from_numpy(np.load(emb_file, mmap_mode="c"))
+        exact, t_exact = _run(embeddings, **kwargs)
+        line = ""
+        if method == "anchors":
+            other, t_other = _run(embeddings, max_num_anchors=max_num_anchors, **kwargs)
+        else:
+            other, emitted, latency = _run_online(embeddings, **kwargs, **online_kwargs)
+            t_other = sum(latency)
+            latencies += latency
+            emitted_agreement = label_agreement(exact, emitted)
+            emitted_agreed += emitted_agreement * len(exact)
+            line = f" (emitted {100 * emitted_agreement:.2f}%)"
+
+        agreement = label_agreement(exact, other)
+        total += len(exact)
+        agreed += agreement * len(exact)
+        same_count += len(set(exact)) == len(set(other))
+        exact_time += t_exact
+        other_time += t_other
+        print(
+            f"{os.path.basename(emb_file)}: {len(exact)} embeddings, "
+            f"{len(set(exact))} vs {len(set(other))} speakers, "
+            f"agreement {100 * agreement:.2f}%{line}, "
+            f"{t_exact:.2f}s vs {t_other:.2f}s"
+        )
+
+    if total > 0:
+        print(f"Agreement: {100 * agreed / total:.2f}%")
+        if method == "online":
+            print(f"Agreement of emitted labels: {100 * emitted_agreed / total:.2f}%")
+            latencies = np.array(latencies) * 1000
+            print(
+                f"Latency per embedding: mean {latencies.mean():.2f}ms, "
+                f"p99 {np.percentile(latencies, 99):.2f}ms, max {latencies.max():.2f}ms"
+            )
+        print(f"Same num of speakers: {same_count}/{len(emb_files)}")
+        print(f"Time: {exact_time:.2f}s (exact) vs {other_time:.2f}s ({method})")
+
+
+def main():
+    fire.Fire(clustering_agreement_main)
+
+
+if __name__ == "__main__":
+    fire.Fire(clustering_agreement_main)
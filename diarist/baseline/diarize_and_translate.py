@@ -1,67 +1,61 @@
 #!/usr/bin/env python3
 
 import os
+import time
 
 import fire
-import torch
-import torchaudio
-import whisper
-from speechbrain.pretrained import EncoderClassifier
-from speechbrain.pretrained import VAD
 
+# torch and the modules importing it are imported by the functions that use
+# them, so that --help and argument errors do not wait for them
+from diarist.result_store import ResultStore
+from diarist.profiling import Profiler, NULL_TRACE
 
-from diarist.baseline.utils import get_frame, get_list, dump_result
-from diarist.baseline.clustering import clustering
 
+def load_sample(in_wav, vad_model=None, trace=NULL_TRACE):
+    """load audio and detect speech boundaries"""
+    from diarist.baseline.audio import load_audio, get_speech_segments
 
-def process_one_sample(
-    in_wav,
-    st_model,
-    spk_model,
-    vad_model=None,
-    beam_size=5,
-    condition_on_previous_text=False,
+    with trace.span("load"):
+        audio, sr = load_audio(in_wav)
+    trace.audio_sec = audio.shape[1] / sr
+
+    # VAD on the decoded audio
+    if vad_model is not None:
+        with trace.span("vad"):
+            boundaries = get_speech_segments(vad_model, audio).tolist()
+    else:
+        boundaries = [[0.0, audio.shape[1] / sr]]
+    return audio, sr, boundaries
+
+
+def cluster_segments(
+    embeddings,
+    boundaries,
     num_speakers=-1,
     max_num_speakers=6,
+    max_num_anchors=0,
+    online=False,
     window_size=1.2,
     window_shift=0.6,
 ):
-    """process_one_sample"""
-
-    torch.manual_seed(777)
-    torch.cuda.manual_seed(777)
+    """cluster the sliding window embeddings into [start, end, speaker] segments"""
+    if online:
+        from diarist.baseline.online_clustering import online_clustering
 
-    #
-    # Speaker embedding extraction
-    #
-    audio, sr = torchaudio.load(in_wav)
-    assert sr == 16000
-    assert audio.shape[0] == 1
-
-    # VAD
-    if vad_model is not None:
-        boundaries = vad_model.get_speech_segments(in_wav).tolist()
+        clust_result, _ = online_clustering(
+            embeddings,
+            num_speakers=num_speakers,
+            max_num_speakers=max_num_speakers,
+        )
     else:
-        boundaries = [[0.0, audio.shape[1] / sr]]
-
-    # extract speaker embeddings with sliding window
-    emb_list = []
-    for boundary_start, boundary_end in boundaries:
-        boundary_dur = boundary_end - boundary_start
-        num_shift = int(boundary_dur / window_shift)
-        for i in range(num_shift):
-            start_sec = boundary_start + window_shift * i
-            start_fr, end_fr = get_frame(
-                start_sec, start_sec + window_size, audio.shape[1], window_size
-            )
-            embedding = spk_model.encode_batch(audio[0, start_fr:end_fr]).reshape(-1)
-            emb_list.append(embedding)
-    stacked_embedding = torch.stack(emb_list)
+        from diarist.baseline.clustering import clustering
 
-    # clustering
-    clust_result = clustering(
-        stacked_embedding, num_speakers=num_speakers, max_num_speakers=max_num_speakers
-    )
+        clust_result = clustering(
+            embeddings,
+            num_speakers=num_speakers,
+            max_num_speakers=max_num_speakers,
+            max_num_anchors=max_num_anchors,
+        )
 
     # aggregate segments for the same speaker
     segment_result = []
@@ -90,89 +84,330 @@ def process_one_sample(
             prev_spk = cur_spk
         if seg_start != prev_time:
             segment_result.append([seg_start, prev_time, prev_spk])
+    return segment_result
 
-    #
-    # apply speech translation
-    #
+
+def segment_clips(audio, sr, segment_result):
+    """float32 audio of each segment, the input of `translate_segments`"""
+    from diarist.baseline.audio import to_float32
+
+    return [
+        to_float32(audio[0, int(start * sr) : int(end * sr)])
+        for start, end, _ in segment_result
+    ]
+
+
+def format_result(segment_result, texts):
+    """tsv lines of the translated segments, dropping empty translations"""
     diar_result = []
-    for start, end, spk in segment_result:
-        decode_options = {
-            "task": "translate",
-            "beam_size": beam_size,
-            "condition_on_previous_text": condition_on_previous_text,
-        }
-        st_result = st_model.transcribe(
-            audio[0, int(start * sr) : int(end * sr)], **decode_options
-        )
-        text = st_result["text"]
+    for (start, end, spk), text in zip(segment_result, texts):
         text = " ".join(text.split())  # remove redundant spaces
         if text != "":
             diar_result.append(f"guest_{spk}\t{start}\t{end}\t{text}")
     return diar_result
 
 
+def process_one_sample(
+    in_wav,
+    st_model,
+    spk_model,
+    vad_model=None,
+    beam_size=5,
+    condition_on_previous_text=False,
+    num_speakers=-1,
+    max_num_speakers=6,
+    max_num_anchors=0,
+    online=False,
+    window_size=1.2,
+    window_shift=0.6,
+    batch_size=64,
+    st_batch_size=8,
+    emb_cache=None,
+    sample=None,
+    trace=NULL_TRACE,
+):
+    """process_one_sample
+
+    `sample` is the output of `load_sample`, loaded here if not given.
+    The time of each stage is added to `trace` (see `diarist.profiling`).
+    Speaker embeddings are reused from `emb_cache` (an `EmbeddingCache`) if given.
+    With `online`, windows are clustered one by one with `OnlineClustering`.
+    """
+    import torch
+    from diarist.baseline.utils import get_window_frames
+    from diarist.baseline.cache import cached_embed_frames
+    from diarist.baseline.translation import translate_segments
+
+    torch.manual_seed(777)
+    torch.cuda.manual_seed(777)
+
+    #
+    # Speaker embedding extraction
+    #
+    if sample is None:
+        sample = load_sample(in_wav, vad_model, trace)
+    audio, sr, boundaries = sample
+
+    # extract speaker embeddings with sliding window
+    frames = get_window_frames(boundaries, audio.shape[1], window_size, window_shift)
+    with trace.span("embedding"):
+        stacked_embedding = cached_embed_frames(
+            spk_model,
+            audio[0],
+            frames,
+            in_wav,
+            batch_size=batch_size,
+            emb_cache=emb_cache,
+        )
+
+    # clustering and aggregation of the windows into speaker segments
+    with trace.span("clustering"):
+        segment_result = cluster_segments(
+            stacked_embedding,
+            boundaries,
+            num_speakers=num_speakers,
+            max_num_speakers=max_num_speakers,
+            max_num_anchors=max_num_anchors,
+            online=online,
+            window_size=window_size,
+            window_shift=window_shift,
+        )
+
+    #
+    # apply speech translation
+    #
+    clips = segment_clips(audio, sr, segment_result)
+    with trace.span("st"):
+        texts = translate_segments(
+            st_model,
+            clips,
+            beam_size=beam_size,
+            condition_on_previous_text=condition_on_previous_text,
+            batch_size=st_batch_size,
+        )
+    return format_result(segment_result, texts)
+
+
+def load_models(
+    rank=0,
+    st_model_size="small",
+    apply_VAD=True,
+    st_backend="whisper",
+    spk_backend="ecapa",
+    model_dir="",
+):
+    """load the ST, speaker embedding and VAD models of the selected backends
+
+    With `model_dir`, the models are loaded from a diarist_snapshot directory.
+    """
+    import torch
+    from diarist.baseline.backends import load_st_backend, load_spk_backend, load_vad
+
+    device = "cpu"
+    if torch.cuda.is_available():
+        device = f"cuda:{rank % torch.cuda.device_count()}"
+    st_model = load_st_backend(st_backend, st_model_size, device, model_dir)
+    spk_model = load_spk_backend(spk_backend, device, model_dir)
+    vad_model = None
+    if apply_VAD:
+        vad_model = load_vad(model_dir)
+    return st_model, spk_model, vad_model
+
+
+def _process_job(models, job):
+    """process one file in a worker of `run_worker_pool`"""
+    from diarist.baseline.utils import dump_result
+
+    in_wav, out_tsv, options, result_store, profiler = job
+    st_model, spk_model, vad_model = models
+    trace = profiler.trace(in_wav)
+    print(f"Processing {in_wav}")
+    diar_result = process_one_sample(
+        in_wav, st_model, spk_model, vad_model=vad_model, trace=trace, **options
+    )
+    print(f"Generate {out_tsv}")
+    with trace.span("write"):
+        dump_result(diar_result, out_tsv, result_store)
+    profiler.finish(trace)
+
+
 def diarize_and_translate_main(
     in_wav="",
     out_tsv="",
     in_dir="",
     out_dir="",
+    result_store="",
+    ali_meeting_dir="",
+    subset="dev",
+    condition="SDM",
     st_model_size="small",
+    st_backend="whisper",
+    spk_backend="ecapa",
+    model_dir="",
     beam_size=5,
     num_speakers=-1,
     max_num_speakers=6,
+    max_num_anchors=0,
+    online=False,
     window_size=1.2,
     window_shift=0.6,
     apply_VAD=True,
+    batch_size=64,
+    st_batch_size=8,
+    prefetch=2,
+    emb_cache_dir="",
+    num_workers=1,
+    num_threads=0,
+    trace_file="",
     rank=0,
     world_size=1,
 ):
-    """main"""
+    """main
+
+    With `result_store`, the results are added to that single file (see
+    `ResultStore`) instead of being written as tsv files, and `out_tsv` and
+    `out_dir` are optional.
+
+    With `ali_meeting_dir`, the mini-sessions of `subset` in `condition`
+    (SDM, IHM-MIX or IHM-CAT) are synthesized from the raw AliMeeting files
+    with `DiariSTDataset` instead of reading the generated wav files.
+
+    With `num_workers` > 1, files are processed longest first by a local
+    pool of workers, each loading the models once and using `num_threads`
+    intra-op threads (by default the CPU cores are split between workers).
+    `st_backend` and `spk_backend` select the ST and speaker models, e.g.
+    "whisper-int8" and "ecapa-jit" for CPU inference (see
+    `diarist.baseline.backends`). With `model_dir`, the models are loaded
+    from a local snapshot written by diarist_snapshot, without network access.
+    Speaker embeddings are stored in and reused from `emb_cache_dir` if given,
+    e.g. to sweep the clustering parameters.
+
+    With `trace_file`, the time of each stage (load, vad, embedding,
+    clustering, st, write), the audio duration and the peak memory are
+    written there as one JSON line per file, and the real time factor and
+    the share of each stage are printed at the end.
+    """
+    from diarist.baseline.backends import check_backends, spk_model_id
+
+    # before importing torch, so that a wrong name fails fast
+    check_backends(st_backend, spk_backend)
+
+    import torch
+    from diarist.baseline.utils import (
+        get_list,
+        sort_by_duration,
+        dump_result,
+        result_exists,
+        run_pipeline,
+        run_worker_pool,
+    )
+    from diarist.baseline.cache import EmbeddingCache
 
     torch.manual_seed(777)
     torch.cuda.manual_seed(777)
 
-    # set models
-    if torch.cuda.is_available():
-        st_model = whisper.load_model(st_model_size, device=f"cuda:{rank}")
-        spk_model = EncoderClassifier.from_hparams(
-            source="speechbrain/spkrec-ecapa-voxceleb",
-            run_opts={"device": f"cuda:{rank}"},
+    options = {
+        "beam_size": beam_size,
+        "num_speakers": num_speakers,
+        "max_num_speakers": max_num_speakers,
+        "max_num_anchors": max_num_anchors,
+        "online": online,
+        "window_size": window_size,
+        "window_shift": window_shift,
+        "batch_size": batch_size,
+        "st_batch_size": st_batch_size,
+        "emb_cache": None,
+    }
+
+    if emb_cache_dir != "":
+        options["emb_cache"] = EmbeddingCache(emb_cache_dir, spk_model_id(spk_backend))
+
+    # set input and output
+    result_store = ResultStore(result_store) if result_store != "" else None
+    if ali_meeting_dir != "":
+        from diarist.data.dataset import get_dataset_list
+
+        in_wav_list, out_tsv_list = get_dataset_list(
+            ali_meeting_dir,
+            subset,
+            condition,
+            out_dir,
+            rank=rank,
+            world_size=world_size,
         )
     else:
-        st_model = whisper.load_model(st_model_size)
-        spk_model = EncoderClassifier.from_hparams(
-            source="speechbrain/spkrec-ecapa-voxceleb"
+        in_wav_list, out_tsv_list = get_list(
+            in_wav,
+            out_tsv,
+            in_dir,
+            out_dir,
+            rank,
+            world_size,
+            named_only=result_store is not None,
         )
-    vad_model = None
-    if apply_VAD:
-        vad_model = VAD.from_hparams(source="speechbrain/vad-crdnn-libriparty")
+    if num_workers > 1:
+        in_wav_list, out_tsv_list = sort_by_duration(in_wav_list, out_tsv_list)
 
-    # set input and output
-    in_wav_list, out_tsv_list = get_list(
-        in_wav, out_tsv, in_dir, out_dir, rank, world_size
+    def pending():
+        for _in_wav, _out_tsv in zip(in_wav_list, out_tsv_list):
+            if result_exists(_out_tsv, result_store):
+                print(f"{_out_tsv} already exists. Skip.")
+                continue
+            yield _in_wav, _out_tsv
+
+    profiler = Profiler(trace_file)
+    profiler.start()
+    if num_workers > 1:
+        jobs = [
+            (_in_wav, _out_tsv, options, result_store, profiler)
+            for _in_wav, _out_tsv in pending()
+        ]
+        start = time.time()
+        run_worker_pool(
+            load_models,
+            (st_model_size, apply_VAD, st_backend, spk_backend, model_dir),
+            _process_job,
+            jobs,
+            num_workers,
+            num_threads=num_threads,
+        )
+        profiler.summary(time.time() - start)
+        return
+
+    # set models
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    st_model, spk_model, vad_model = load_models(
+        rank, st_model_size, apply_VAD, st_backend, spk_backend, model_dir
     )
 
-    # process files
-    for _in_wav, _out_tsv in zip(in_wav_list, out_tsv_list):
-        if os.path.exists(_out_tsv):
-            print(f"{_out_tsv} already exists. Skip.")
-            continue
+    # process files, loading and running VAD on the next files and writing
+    # results in the background
+    def load(item):
+        print(f"Processing {item[0]}")
+        return load_sample(item[0], vad_model, item[2])
 
-        print(f"Processing {_in_wav}")
-        diar_result = process_one_sample(
-            _in_wav,
+    def process(item, sample):
+        return process_one_sample(
+            item[0],
             st_model,
             spk_model,
             vad_model=vad_model,
-            beam_size=beam_size,
-            num_speakers=num_speakers,
-            max_num_speakers=max_num_speakers,
-            window_size=window_size,
-            window_shift=window_shift,
+            sample=sample,
+            trace=item[2],
+            **options,
         )
 
-        print(f"Generate {_out_tsv}")
-        dump_result(diar_result, _out_tsv)
+    def write(item, diar_result):
+        print(f"Generate {item[1]}")
+        with item[2].span("write"):
+            dump_result(diar_result, item[1], result_store)
+        profiler.finish(item[2])
+
+    items = ((w, o, profiler.trace(w)) for w, o in pending())
+    start = time.time()
+    run_pipeline(items, load, process, write, prefetch=prefetch)
+    profiler.summary(time.time() - start)
 
 
 def main():
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import torch
+
+
+def _statistics(x, weights, eps):
+    mean = (weights * x).sum(2)
+    std = torch.sqrt((weights * (x - mean.unsqueeze(2)).pow(2)).sum(2).clamp(eps))
+    return mean, std
+
+
+class _UnpaddedEcapa(torch.nn.Module):
+    """`EncoderClassifier.encode_batch` for unpadded batches, in traceable form
+
+    Without padding, the sentence mean normalization and the masks of the
+    attentive statistics pooling reduce to plain means over time, which
+    keeps the batch size and the length out of the traced graph.
+    """
+
+    def __init__(self, classifier):
+        super().__init__()
+        self.compute_features = classifier.mods.compute_features
+        self.ecapa = classifier.mods.embedding_model
+
+    def forward(self, wavs):
+        feats = self.compute_features(wavs)
+        x = (feats - feats.mean(dim=1, keepdim=True)).transpose(1, 2)
+        xl = []
+        for layer in self.ecapa.blocks:
+            x = layer(x)
+            xl.append(x)
+        x = self.ecapa.mfa(torch.cat(xl[1:], dim=1))
+
+        # attentive statistics pooling
+        asp = self.ecapa.asp
+        mean, std = _statistics(x, torch.ones_like(x[:, :1]) / x.shape[2], asp.eps)
+        attn = torch.cat(
+            [x, mean.unsqueeze(2).expand_as(x), std.unsqueeze(2).expand_as(x)], dim=1
+        )
+        attn = torch.softmax(asp.conv(asp.tanh(asp.tdnn(attn))), dim=2)
+        mean, std = _statistics(x, attn, asp.eps)
+        x = self.ecapa.asp_bn(torch.cat([mean, std], dim=1).unsqueeze(2))
+        return self.ecapa.fc(x).transpose(1, 2)
+
+
+class TracedSpeakerModel:
+    """speaker model running a frozen TorchScript trace of an `EncoderClassifier`"""
+
+    def __init__(self, classifier):
+        self.device = classifier.device
+        example = torch.randn(2, 24000, device=self.device)
+        with torch.no_grad():
+            traced = torch.jit.trace(_UnpaddedEcapa(classifier).eval(), example)
+            self.module = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+            # guard against changes of the SpeechBrain modules
+            example = torch.randn(3, 16000, device=self.device)
+            expected = classifier.encode_batch(example)
+            if not torch.allclose(self.encode_batch(example), expected, atol=1e-4):
+                raise RuntimeError("Traced speaker model differs from encode_batch")
+
+    def encode_batch(self, wavs):
+        with torch.no_grad():
+            return self.module(wavs.to(self.device).float())
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import torch
+from scipy.optimize import linear_sum_assignment
+
+from diarist.baseline.clustering import clustering
+
+
+class OnlineClustering:
+    """incremental speaker clustering of a stream of embeddings
+
+    Embeddings are summarized by at most `max_num_centroids` centroids, each
+    assigned to one of at most `max_num_speakers` speakers. A new embedding
+    joins its nearest centroid if it is at least `centroid_threshold` similar,
+    otherwise it starts a new centroid, merging the two closest centroids
+    when there are too many. So every step costs O(max_num_centroids^2). A
+    new centroid joins the nearest speaker, or starts a new speaker if it is
+    less similar than `speaker_threshold`. Every `recluster_interval` steps
+    the centroids are re-clustered with `clustering` and the new speakers are
+    matched to the old ones to keep labels stable, which may revise the
+    labels of earlier embeddings.
+
+    With `keep_history`, the centroid of every embedding is recorded for
+    `labels`. Without it, as for endless streams, memory stays bounded by
+    the number of centroids and only the labels returned by `add` are known.
+    """
+
+    def __init__(
+        self,
+        num_speakers=-1,
+        max_num_speakers=6,
+        max_num_centroids=64,
+        centroid_threshold=0.5,
+        speaker_threshold=0.4,
+        recluster_interval=50,
+        keep_history=True,
+    ):
+        self.num_speakers = num_speakers
+        self.max_num_speakers = max_num_speakers
+        self.max_num_centroids = max_num_centroids
+        self.centroid_threshold = centroid_threshold
+        self.speaker_threshold = speaker_threshold
+        self.recluster_interval = recluster_interval
+        self.num_labels = max(num_speakers, max_num_speakers)
+        self.keep_history = keep_history
+        self.num_added = 0
+        self.next_id = 0
+
+        # live centroids
+        self.sums = None  # (num_centroids, dim) sums of normalized embeddings
+        self.counts = []  # num of embeddings
+        self.spks = []  # speaker label
+        self.ids = []  # centroid id
+        # with keep_history, every centroid ever created has an entry; merged
+        # ids point to the id they were merged into
+        self.parent = []
+        self.centroid_of = []  # centroid id of each embedding, with keep_history
+
+    def _find(self, i):
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def _centroids(self):
+        return torch.nn.functional.normalize(self.sums, dim=1)
+
+    def _speaker_of_new_centroid(self, emb):
+        spks = torch.tensor(self.spks, device=self.sums.device)
+        spk_sums = torch.zeros(
+            self.num_labels, self.sums.shape[1], device=self.sums.device
+        ).index_add_(0, spks, self.sums)
+        sims = torch.nn.functional.normalize(spk_sums, dim=1) @ emb
+        used = set(self.spks)
+        best = max(used, key=lambda spk: sims[spk].item())
+        max_spks = self.num_speakers if self.num_speakers > 0 else self.max_num_speakers
+        if sims[best] < self.speaker_threshold and len(used) < max_spks:
+            return min(set(range(self.num_labels)) - used)
+        return best
+
+    def _add_centroid(self, emb, spk):
+        if self.keep_history:
+            self.parent.append(self.next_id)
+        self.ids.append(self.next_id)
+        self.next_id += 1
+        self.counts.append(1)
+        self.spks.append(spk)
+        if self.sums is None:
+            self.sums = emb[None].clone()
+        else:
+            self.sums = torch.cat([self.sums, emb[None]])
+
+    def _merge_closest(self):
+        """merge the two closest centroids, returning the merged and the kept id"""
+        centroids = self._centroids()
+        sims = centroids @ centroids.T
+        sims.fill_diagonal_(-float("inf"))
+        i, j = divmod(int(torch.argmax(sims)), len(self.counts))
+        i, j = min(i, j), max(i, j)
+        self.sums[i] += self.sums[j]
+        if self.counts[j] > self.counts[i]:
+            self.spks[i] = self.spks[j]
+        self.counts[i] += self.counts[j]
+        merged, kept = self.ids[j], self.ids[i]
+        if self.keep_history:
+            self.parent[merged] = kept
+        self.sums = torch.cat([self.sums[:j], self.sums[j + 1 :]])
+        for values in [self.counts, self.spks, self.ids]:
+            del values[j]
+        return merged, kept
+
+    def add(self, embedding):
+        """add the next embedding and return its speaker label"""
+        emb = torch.nn.functional.normalize(embedding.float().flatten(), dim=0)
+        self.num_added += 1
+        if self.sums is None:
+            self._add_centroid(emb, 0)
+            if self.keep_history:
+                self.centroid_of.append(self.ids[-1])
+            return 0
+
+        sims = self._centroids() @ emb
+        best = int(torch.argmax(sims))
+        if sims[best] >= self.centroid_threshold:
+            self.sums[best] += emb
+            self.counts[best] += 1
+            centroid_id = self.ids[best]
+        else:
+            self._add_centroid(emb, self._speaker_of_new_centroid(emb))
+            centroid_id = self.ids[-1]
+            if len(self.counts) > self.max_num_centroids:
+                merged, kept = self._merge_closest()
+                if centroid_id == merged:
+                    centroid_id = kept
+        if self.keep_history:
+            self.centroid_of.append(centroid_id)
+
+        if self.num_added % self.recluster_interval == 0:
+            self.recluster()
+        return self.spks[self.ids.index(centroid_id)]
+
+    def recluster(self):
+        """re-cluster the centroids, keeping the labels of matching speakers"""
+        if len(self.counts) <= self.max_num_speakers:
+            return
+        new_spks = clustering(
+            self._centroids(),
+            num_speakers=self.num_speakers,
+            max_num_speakers=self.max_num_speakers,
+        )
+        new_spks = [int(y) for y in new_spks]
+
+        # match new clusters to old speakers by the num of shared embeddings
+        overlap = np.zeros((self.num_labels, self.num_labels))
+        for old, new, count in zip(self.spks, new_spks, self.counts):
+            overlap[new, old] += count
+        rows, cols = linear_sum_assignment(-overlap)
+        mapping = dict(zip(rows.tolist(), cols.tolist()))
+        self.spks = [mapping[new] for new in new_spks]
+
+    def labels(self):
+        """current speaker labels of all embeddings added so far"""
+        if not self.keep_history:
+            raise ValueError("labels() needs keep_history=True")
+        spk_of = dict(zip(self.ids, self.spks))
+        return torch.tensor(
+            [spk_of[self._find(i)] for i in self.centroid_of], dtype=torch.long
+        )
+
+
+def online_clustering(embeddings, **kwargs):
+    """cluster embeddings one by one with `OnlineClustering`
+
+    Returns the final labels of all embeddings and the labels emitted when
+    each embedding was added.
+    """
+    clusterer = OnlineClustering(**kwargs)
+    emitted = [clusterer.add(emb) for emb in embeddings]
+    return clusterer.labels(), torch.tensor(emitted, dtype=torch.long)
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import json
+import time
+import wave
+import threading
+import socketserver
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import fire
+import numpy as np
+import torch
+
+from diarist.baseline.utils import get_window_frames, embed_frames
+from diarist.baseline.audio import get_speech_segments
+from diarist.baseline.backends import check_backends
+from diarist.baseline.diarize_and_translate import (
+    load_models,
+    cluster_segments,
+    segment_clips,
+    format_result,
+)
+from diarist.baseline.translation import translate_segments
+from diarist.profiling import Profiler, Trace
+
+# per-request options, given as query parameters
+REQUEST_OPTIONS = {
+    "num_speakers": int,
+    "max_num_speakers": int,
+    "max_num_anchors": int,
+    "online": lambda x: x.lower() in ("1", "true"),
+}
+
+
+class MicroBatcher:
+    """runs `batch_fn` on a background thread over items of concurrent requests
+
+    `submit` queues an item and returns a `Future` of its result. The
+    oldest pending item is batched with the following items of the same
+    `key`, up to `max_batch` in total `size`, as soon as the batch is full
+    or the oldest item has waited `max_wait` seconds. `batch_fn(items)`
+    returns one result per item.
+    """
+
+    def __init__(self, batch_fn, max_batch, max_wait):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = deque()
+        self.cond = threading.Condition()
+        self.num_batches = 0
+        self.num_items = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, item, key=None, size=1):
+        future = Future()
+        with self.cond:
+            self.pending.append((key, size, item, future, time.perf_counter()))
+            self.cond.notify()
+        return future
+
+    def depth(self):
+        """total size of the pending items"""
+        with self.cond:
+            return sum(entry[1] for entry in self.pending)
+
+    def _take(self):
+        with self.cond:
+            while True:
+                while len(self.pending) == 0:
+                    self.cond.wait()
+                key = self.pending[0][0]
+                batch = []
+                total = 0
+                full = False
+                for entry in self.pending:
+                    if entry[0] != key:
+                        continue
+                    if len(batch) > 0 and total + entry[1] > self.max_batch:
+                        full = True
+                        continue
+                    batch.append(entry)
+                    total += entry[1]
+                wait = self.pending[0][4] + self.max_wait - time.perf_counter()
+                if full or total >= self.max_batch or wait <= 0:
+                    taken = set(id(entry) for entry in batch)
+                    self.pending = deque(
+                        entry for entry in self.pending if id(entry) not in taken
+                    )
+                    return batch
+                self.cond.wait(wait)
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            try:
+                results = self.batch_fn([entry[2] for entry in batch])
+            except Exception as err:
+                for entry in batch:
+                    entry[3].set_exception(err)
+                continue
+            self.num_batches += 1
+            self.num_items += sum(entry[1] for entry in batch)
+            for entry, result in zip(batch, results):
+                entry[3].set_result(result)
+
+    def stats(self):
+        mean_size = self.num_items / self.num_batches if self.num_batches > 0 else 0.0
+        return {
+            "depth": self.depth(),
+            "num_batches": self.num_batches,
+            "mean_batch_size": mean_size,
+        }
+
+
+def decode_wav(data):
+    """(1, T) int16 tensor of 16 kHz mono 16-bit PCM wav bytes, as `load_audio` gives"""
+    try:
+        f = wave.open(io.BytesIO(data), "rb")
+    except (EOFError, wave.Error) as err:
+        raise ValueError("Expected a wav file") from err
+    with f:
+        if f.getframerate() != 16000 or f.getnchannels() != 1:
+            raise ValueError("Expected 16 kHz mono audio")
+        if f.getsampwidth() != 2:
+            raise ValueError("Expected 16-bit PCM audio")
+        samples = np.frombuffer(f.readframes(f.getnframes()), dtype="<i2")
+    return torch.from_numpy(samples.astype(np.int16))[None], 16000
+
+
+def percentiles(values):
+    if len(values) == 0:
+        return {}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"p50": float(p50), "p90": float(p90), "p99": float(p99)}
+
+
+class DiarizeTranslateService:
+    """diarization --> translation of concurrent requests with resident models
+
+    Every request runs the stages of `process_one_sample` on its own thread
+    and returns the same tsv lines. The windows to embed and the segments to
+    translate are handed to two `MicroBatcher`s, so the speaker model and
+    the ST model run batches across the requests in flight, each waiting at
+    most `max_wait` seconds for a batch to fill. VAD and clustering take
+    turns under locks, the latter re-seeded as in `process_one_sample`.
+    Clips that fall back to the temperature sampling of `transcribe` may
+    still differ, as their random draws depend on the batch.
+    """
+
+    def __init__(
+        self,
+        st_model,
+        spk_model,
+        vad_model=None,
+        beam_size=5,
+        window_size=1.2,
+        window_shift=0.6,
+        batch_size=64,
+        st_batch_size=8,
+        max_wait=0.05,
+        stats_window=1000,
+        profiler=None,
+    ):
+        self.st_model = st_model
+        self.spk_model = spk_model
+        self.vad_model = vad_model
+        self.beam_size = beam_size
+        self.window_size = window_size
+        self.window_shift = window_shift
+        self.batch_size = batch_size
+        self.profiler = profiler if profiler is not None else Profiler()
+
+        self.emb_batcher = MicroBatcher(self._embed_batch, batch_size, max_wait)
+        self.st_batcher = MicroBatcher(self._translate_batch, st_batch_size, max_wait)
+        self.vad_lock = threading.Lock()
+        self.clustering_lock = threading.Lock()
+
+        self.stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.num_requests = 0
+        self.num_errors = 0
+        # (latency, audio seconds, stage seconds) of the last requests
+        self.history = deque(maxlen=stats_window)
+
+    def _embed_batch(self, items):
+        embeddings = self.spk_model.encode_batch(torch.cat(items))
+        return torch.split(embeddings, [len(wavs) for wavs in items])
+
+    def _translate_batch(self, clips):
+        return translate_segments(
+            self.st_model, clips, beam_size=self.beam_size, batch_size=len(clips)
+        )
+
+    def encode_batch(self, wavs):
+        """speaker embeddings of (B, T) windows, batched with other requests"""
+        return self.emb_batcher.submit(wavs, key=wavs.shape[1], size=len(wavs)).result()
+
+    def process(
+        self,
+        audio,
+        sr,
+        name="",
+        num_speakers=-1,
+        max_num_speakers=6,
+        max_num_anchors=0,
+        online=False,
+    ):
+        """tsv lines of a (1, T) `load_audio` buffer"""
+        start = time.perf_counter()
+        trace = Trace(name)
+        trace.audio_sec = audio.shape[1] / sr
+        with self.stats_lock:
+            self.in_flight += 1
+        try:
+            boundaries = [[0.0, audio.shape[1] / sr]]
+            if self.vad_model is not None:
+                with self.vad_lock, trace.span("vad"):
+                    boundaries = get_speech_segments(self.vad_model, audio).tolist()
+
+            frames = get_window_frames(
+                boundaries, audio.shape[1], self.window_size, self.window_shift
+            )
+            with trace.span("embedding"):
+                embeddings = torch.stack(
+                    embed_frames(self, audio[0], frames, batch_size=self.batch_size)
+                )
+
+            with self.clustering_lock, trace.span("clustering"):
+                torch.manual_seed(777)
+                torch.cuda.manual_seed(777)
+                segment_result = cluster_segments(
+                    embeddings,
+                    boundaries,
+                    num_speakers=num_speakers,
+                    max_num_speakers=max_num_speakers,
+                    max_num_anchors=max_num_anchors,
+                    online=online,
+                    window_size=self.window_size,
+                    window_shift=self.window_shift,
+                )
+
+            with trace.span("st"):
+                futures = [
+                    self.st_batcher.submit(clip)
+                    for clip in segment_clips(audio, sr, segment_result)
+                ]
+                texts = [future.result() for future in futures]
+            diar_result = format_result(segment_result, texts)
+        except Exception:
+            with self.stats_lock:
+                self.num_errors += 1
+            raise
+        finally:
+            with self.stats_lock:
+                self.in_flight -= 1
+
+        latency = time.perf_counter() - start
+        with self.stats_lock:
+            self.num_requests += 1
+            self.history.append((latency, trace.audio_sec, dict(trace.stages)))
+        self.profiler.finish(trace)
+        return diar_result
+
+    def stats(self):
+        """queue depths, batch sizes and latency percentiles of the last requests"""
+        with self.stats_lock:
+            history = list(self.history)
+            stats = {
+                "in_flight": self.in_flight,
+                "num_requests": self.num_requests,
+                "num_errors": self.num_errors,
+            }
+        stats["embedding_windows"] = self.emb_batcher.stats()
+        stats["st_clips"] = self.st_batcher.stats()
+
+        latency = {"total": percentiles([x[0] for x in history])}
+        for stage in ("vad", "embedding", "clustering", "st"):
+            values = [x[2][stage] for x in history if stage in x[2]]
+            latency[stage] = percentiles(values)
+        stats["latency_sec"] = latency
+        audio_sec = sum(x[1] for x in history)
+        if audio_sec > 0:
+            stats["rtf"] = sum(x[0] for x in history) / audio_sec
+        return stats
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """POST /process with a wav file as the body, GET /stats"""
+
+    service = None
+
+    def address_string(self):
+        # no client address on a unix socket
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+    def _reply(self, code, body, content_type="text/plain; charset=utf-8"):
+        data = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/stats":
+            self._reply(404, "Not found\n")
+            return
+        stats = json.dumps(self.service.stats(), indent=4)
+        self._reply(200, stats + "\n", "application/json")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/process":
+            self._reply(404, "Not found\n")
+            return
+        if self.headers.get("Content-Length") is None:
+            self._reply(411, "Content-Length required\n")
+            return
+        data = self.rfile.read(int(self.headers["Content-Length"]))
+
+        query = parse_qs(url.query)
+        name = query.pop("name", [""])[0]
+        try:
+            options = {}
+            for key, values in query.items():
+                if key not in REQUEST_OPTIONS:
+                    raise ValueError(f"Unknown option {key}")
+                options[key] = REQUEST_OPTIONS[key](values[0])
+            audio, sr = decode_wav(data)
+        except ValueError as err:
+            self._reply(400, f"{err}\n")
+            return
+
+        try:
+            diar_result = self.service.process(audio, sr, name=name, **options)
+        except Exception as err:
+            self._reply(500, f"{type(err).__name__}: {err}\n")
+            return
+        body = "".join(f"{line}\n" for line in diar_result)
+        self._reply(200, body, "text/tab-separated-values; charset=utf-8")
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def service_main(
+    host="127.0.0.1",
+    port=8765,
+    unix_socket="",
+    st_model_size="small",
+    st_backend="whisper",
+    spk_backend="ecapa",
+    model_dir="",
+    apply_VAD=True,
+    beam_size=5,
+    window_size=1.2,
+    window_shift=0.6,
+    batch_size=64,
+    st_batch_size=8,
+    max_wait=0.05,
+    num_threads=0,
+    trace_file="",
+):
+    """serve diarization --> translation over localhost HTTP or a unix socket
+
+    The models are loaded once as in `diarist_baseline_dt`. POST a 16 kHz
+    mono 16-bit PCM wav file to /process to get the tsv lines of
+    `process_one_sample`; `num_speakers`, `max_num_speakers`,
+    `max_num_anchors`, `online` and `name` may be given as query parameters.
+    Embedding and translation are batched across the requests in flight,
+    up to `batch_size` windows and `st_batch_size` segments, waiting at most
+    `max_wait` seconds for a batch to fill. GET /stats returns the queue
+    depths, the mean batch sizes and the latency percentiles. With
+    `trace_file`, the stage timings of every request are written there as
+    with `diarist_baseline_dt --trace_file`.
+    """
+    check_backends(st_backend, spk_backend)
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    st_model, spk_model, vad_model = load_models(
+        0, st_model_size, apply_VAD, st_backend, spk_backend, model_dir
+    )
+    profiler = Profiler(trace_file)
+    profiler.start()
+    _RequestHandler.service = DiarizeTranslateService(
+        st_model,
+        spk_model,
+        vad_model=vad_model,
+        beam_size=beam_size,
+        window_size=window_size,
+        window_shift=window_shift,
+        batch_size=batch_size,
+        st_batch_size=st_batch_size,
+        max_wait=max_wait,
+        profiler=profiler,
+    )
+
+    if unix_socket != "":
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = _UnixHTTPServer(unix_socket, _RequestHandler)
+        print(f"Serving on {unix_socket}")
+    else:
+        server = ThreadingHTTPServer((host, port), _RequestHandler)
+        print(f"Serving on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_socket != "":
+            os.remove(unix_socket)
+
+
+def main():
+    fire.Fire(service_main)
+
+
+if __name__ == "__main__":
+    fire.Fire(service_main)
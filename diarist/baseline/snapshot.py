@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import shutil
+
+import fire
+import torch
+
+from diarist.baseline.backends import (
+    SPK_MODEL_SOURCE,
+    VAD_MODEL_SOURCE,
+    SNAPSHOT_INFO,
+    whisper_snapshot,
+    speechbrain_snapshot,
+)
+
+
+def _copy_links(savedir):
+    """replace the links into the hub cache by copies of the files"""
+    for name in os.listdir(savedir):
+        path = os.path.join(savedir, name)
+        if os.path.islink(path):
+            target = os.path.realpath(path)
+            os.remove(path)
+            shutil.copyfile(target, path)
+
+
+def snapshot_main(model_dir, st_model_size="small", apply_VAD=True):
+    """save the whisper, ECAPA and VAD models into `model_dir` once
+
+    The baselines load them from there with `--model_dir`, without hub
+    resolution or network access. Whisper is saved as the pickled fp32
+    model, which is memory-mapped when loaded; run again for other
+    `st_model_size` or after upgrading whisper.
+    """
+    import whisper
+    from speechbrain.pretrained import EncoderClassifier, VAD
+
+    os.makedirs(model_dir, exist_ok=True)
+    info_json = os.path.join(model_dir, SNAPSHOT_INFO)
+    info = {}
+    if os.path.exists(info_json):
+        with open(info_json) as f:
+            info = json.load(f)
+
+    path = whisper_snapshot(model_dir, st_model_size)
+    torch.save(whisper.load_model(st_model_size, device="cpu"), path)
+    info[os.path.basename(path)] = {
+        "whisper": whisper.__version__,
+        "torch": torch.__version__,
+    }
+    print(f"Saved {path}")
+
+    models = [(EncoderClassifier, SPK_MODEL_SOURCE)]
+    if apply_VAD:
+        models.append((VAD, VAD_MODEL_SOURCE))
+    for cls, source in models:
+        savedir = speechbrain_snapshot(model_dir, source)
+        cls.from_hparams(source=source, savedir=savedir)
+        _copy_links(savedir)
+        info[os.path.basename(savedir)] = {"source": source}
+        print(f"Saved {savedir}")
+
+    with open(info_json, "w") as f:
+        json.dump(info, f, indent=4)
+
+
+def main():
+    fire.Fire(snapshot_main)
+
+
+if __name__ == "__main__":
+    fire.Fire(snapshot_main)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+
+import fire
+import torch
+
+from diarist.baseline.audio import load_audio, to_float32
+from diarist.baseline.backends import check_backends, load_st_backend, st_fp16
+from diarist.baseline.cache import TranslationCache, cached_transcribe
+from diarist.baseline.translation import st_model_id
+from diarist.baseline.utils import sort_by_duration, run_worker_pool
+
+
+def load_st_model(rank=0, st_model_size="small", st_backend="whisper", model_dir=""):
+    """load the ST model, from a diarist_snapshot directory with `model_dir`"""
+    device = "cpu"
+    if torch.cuda.is_available():
+        device = f"cuda:{rank % torch.cuda.device_count()}"
+    return load_st_backend(st_backend, st_model_size, device, model_dir)
+
+
+def _translate_job(st_model, job):
+    """translate one file into the cache, as translate_and_diarize does"""
+    in_wav, decode_options, st_cache = job
+    print(f"Processing {in_wav}")
+    audio, _ = load_audio(in_wav)
+    torch.manual_seed(777)
+    torch.cuda.manual_seed(777)
+    cached_transcribe(
+        st_model, in_wav, decode_options, st_cache, audio=to_float32(audio[0])
+    )
+
+
+def st_cache_main(
+    st_cache_dir,
+    in_wav="",
+    in_dir="",
+    st_model_size="small",
+    st_backend="whisper",
+    model_dir="",
+    beam_size=5,
+    condition_on_previous_text=False,
+    num_workers=1,
+    num_threads=0,
+    rank=0,
+    world_size=1,
+):
+    """pre-populate the translation cache of diarist_baseline_td
+
+    The options must match those of the later `diarist_baseline_td` runs.
+    """
+    if in_wav != "":
+        in_wav_list = [in_wav]
+    elif in_dir != "":
+        in_wav_list = sorted(glob.glob(f"{in_dir}/**/*.wav", recursive=True))
+        in_wav_list = [x for i, x in enumerate(in_wav_list) if i % world_size == rank]
+    else:
+        raise ValueError("in_wav or in_dir must be set.")
+    check_backends(st_backend)
+
+    decode_options = {
+        "task": "translate",
+        "beam_size": beam_size,
+        "condition_on_previous_text": condition_on_previous_text,
+    }
+    st_cache = TranslationCache(
+        st_cache_dir, st_model_id(st_model_size, st_backend, st_fp16(st_backend))
+    )
+
+    jobs = []
+    for _in_wav in sort_by_duration(in_wav_list, in_wav_list)[0]:
+        if os.path.exists(st_cache.path(_in_wav, decode_options)):
+            print(f"{_in_wav} is already cached. Skip.")
+            continue
+        jobs.append((_in_wav, decode_options, st_cache))
+
+    if num_workers > 1:
+        run_worker_pool(
+            load_st_model,
+            (st_model_size, st_backend, model_dir),
+            _translate_job,
+            jobs,
+            num_workers,
+            num_threads=num_threads,
+        )
+        return
+
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    st_model = load_st_model(rank, st_model_size, st_backend, model_dir)
+    for job in jobs:
+        _translate_job(st_model, job)
+
+
+def main():
+    fire.Fire(st_cache_main)
+
+
+if __name__ == "__main__":
+    fire.Fire(st_cache_main)
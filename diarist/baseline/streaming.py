@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import struct
+from collections import deque
+
+import fire
+import numpy as np
+
+# torch and the modules importing it are imported by the functions that use
+# them, so that --help and argument errors do not wait for them
+from diarist.baseline.diarize_and_translate import load_models
+
+
+def read_stdin(block_len):
+    """blocks of 16 kHz mono 16-bit PCM samples read from stdin"""
+    stream = sys.stdin.buffer
+    buf = b""
+    while True:
+        data = stream.read(2 * block_len - len(buf))
+        if not data:
+            break
+        buf += data
+        if len(buf) == 2 * block_len:
+            yield buf
+            buf = b""
+    if len(buf) >= 2:
+        yield buf[: len(buf) // 2 * 2]
+
+
+def _wav_data_offset(f):
+    """offset of the samples in a 16 kHz mono 16-bit PCM wav file"""
+    riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+    if riff != b"RIFF" or wave_id != b"WAVE":
+        raise ValueError("Not a wav file.")
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        chunk_id, size = struct.unpack("<4sI", header)
+        if chunk_id == b"data":
+            return f.tell()
+        data = f.read(size + size % 2)
+        if chunk_id == b"fmt ":
+            audio_format, channels, sr, _, _, bits = struct.unpack("<HHIIHH", data[:16])
+            if (audio_format, channels, sr, bits) != (1, 1, 16000, 16):
+                raise ValueError("Only 16 kHz mono 16-bit PCM wav is supported.")
+
+
+def read_growing_wav(in_wav, block_len, poll_interval=0.2, idle_timeout=5.0):
+    """blocks of samples of a wav file that may still be being written
+
+    Stops once the file has not grown for `idle_timeout` seconds.
+    """
+    idle = 0.0
+    with open(in_wav, "rb") as f:
+        offset = None
+        while offset is None:
+            f.seek(0)
+            offset = _wav_data_offset(f)
+            if offset is None:
+                if idle >= idle_timeout:
+                    return
+                time.sleep(poll_interval)
+                idle += poll_interval
+        buf = b""
+        while True:
+            data = f.read(2 * block_len - len(buf))
+            buf += data
+            if len(buf) == 2 * block_len:
+                yield buf
+                buf = b""
+                idle = 0.0
+            elif data:
+                idle = 0.0
+            else:
+                if idle >= idle_timeout:
+                    break
+                time.sleep(poll_interval)
+                idle += poll_interval
+    if len(buf) >= 2:
+        yield buf[: len(buf) // 2 * 2]
+
+
+class StreamingDiarizeTranslate:
+    """diarize->translate over audio blocks as they arrive
+
+    Every block is classified as speech or not by the VAD. Within speech
+    regions, speaker embeddings of sliding windows are clustered online as
+    soon as a window is complete, and the windows are aggregated into
+    segments as in `diarize_and_translate.process_one_sample`. A segment is
+    translated and emitted as soon as it is closed by a speaker change, the
+    end of the speech region or `max_segment_sec`. Only the audio of the open
+    segment is kept, so memory and the compute per segment are bounded.
+    """
+
+    def __init__(
+        self,
+        st_model,
+        spk_model,
+        vad_model=None,
+        beam_size=5,
+        num_speakers=-1,
+        max_num_speakers=6,
+        window_size=1.2,
+        window_shift=0.6,
+        max_segment_sec=20.0,
+        vad_threshold=0.5,
+        sr=16000,
+    ):
+        import torch
+        from diarist.baseline.online_clustering import OnlineClustering
+
+        self.st_model = st_model
+        self.spk_model = spk_model
+        self.vad_model = vad_model
+        self.beam_size = beam_size
+        self.window_size = window_size
+        self.window_shift = window_shift
+        self.max_segment_sec = max_segment_sec
+        self.vad_threshold = vad_threshold
+        self.sr = sr
+        self.clusterer = OnlineClustering(
+            num_speakers=num_speakers,
+            max_num_speakers=max_num_speakers,
+            keep_history=False,
+        )
+
+        self.audio = torch.zeros(0)
+        self.offset = 0  # sample index of self.audio[0]
+        self.total = 0  # num of samples received
+        self.arrivals = deque()  # (num of samples received, time)
+        self.region_start = None  # start of the current speech region in sec
+        self.num_windows = 0  # windows processed in the current region
+        self.seg = None  # [seg_start, prev_time, prev_spk] of the open segment
+        self.latencies = []
+
+    def _is_speech(self, block):
+        if self.vad_model is None:
+            return True
+        prob = self.vad_model.get_speech_prob_chunk(block[None])
+        return prob.mean().item() > self.vad_threshold
+
+    def _emit(self, start, end, spk):
+        from diarist.baseline.translation import translate_segments
+
+        start_fr = int(start * self.sr) - self.offset
+        end_fr = int(end * self.sr) - self.offset
+        clip = self.audio[start_fr:end_fr]
+        text = translate_segments(
+            self.st_model, [clip], beam_size=self.beam_size, batch_size=1
+        )[0]
+        text = " ".join(text.split())  # remove redundant spaces
+        if text == "":
+            return []
+
+        end_fr = int(end * self.sr)
+        arrival = next(t for num, t in self.arrivals if num >= end_fr)
+        self.latencies.append(time.time() - arrival)
+        print(
+            f"emit {start:.2f}-{end:.2f} guest_{spk} latency {self.latencies[-1]:.2f}s",
+            file=sys.stderr,
+        )
+        return [f"guest_{spk}\t{start}\t{end}\t{text}"]
+
+    def _run_windows(self, region_end=None):
+        """cluster the windows of the current region that can be processed"""
+        from diarist.baseline.utils import get_frame, embed_frames
+
+        region_start_fr = int(self.region_start * self.sr)
+        window_len = int(self.window_size * self.sr)
+        shift_len = int(self.window_shift * self.sr)
+        if region_end is None:
+            num_windows = (self.total - region_start_fr - window_len) // shift_len + 1
+        else:
+            num_windows = int((region_end - self.region_start) / self.window_shift)
+
+        indices = list(range(self.num_windows, max(self.num_windows, num_windows)))
+        frames = []
+        for i in indices:
+            start_sec = self.region_start + self.window_shift * i
+            start_fr, end_fr = get_frame(
+                start_sec, start_sec + self.window_size, self.total, self.window_size
+            )
+            frames.append((start_fr - self.offset, end_fr - self.offset))
+        self.num_windows += len(indices)
+        if len(frames) == 0:
+            return []
+        emb_list = embed_frames(self.spk_model, self.audio, frames)
+
+        lines = []
+        for i, emb in zip(indices, emb_list):
+            seg_start, prev_time, prev_spk = self.seg
+            cur_time = (
+                self.region_start
+                + self.window_size * 0.5
+                + self.window_shift * (i + 0.5)
+            )
+            if region_end is not None:
+                cur_time = min(cur_time, region_end)
+            cur_spk = self.clusterer.add(emb)
+            if cur_spk != prev_spk and prev_spk != -1:
+                lines += self._emit(seg_start, prev_time, prev_spk)
+                seg_start = cur_time
+            elif prev_spk != -1 and cur_time - seg_start > self.max_segment_sec:
+                lines += self._emit(seg_start, prev_time, prev_spk)
+                seg_start = prev_time
+            self.seg = [seg_start, cur_time, cur_spk]
+        return lines
+
+    def _close_region(self, region_end):
+        lines = self._run_windows(region_end)
+        seg_start, prev_time, prev_spk = self.seg
+        if seg_start != prev_time:
+            lines += self._emit(seg_start, prev_time, prev_spk)
+        self.region_start = None
+        self.seg = None
+        return lines
+
+    def _prune(self):
+        keep_from = self.total - int(self.window_size * self.sr)
+        if self.region_start is not None:
+            next_window = int(
+                (self.region_start + self.window_shift * self.num_windows) * self.sr
+            )
+            keep_from = min(keep_from, next_window, int(self.seg[0] * self.sr))
+        keep_from = max(keep_from, self.offset)
+        self.audio = self.audio[keep_from - self.offset :]
+        self.offset = keep_from
+        while len(self.arrivals) > 1 and self.arrivals[0][0] < keep_from:
+            self.arrivals.popleft()
+
+    def feed(self, block):
+        """process the next block of samples and return the TSV lines it completes"""
+        import torch
+
+        block_start = self.total / self.sr
+        self.audio = torch.cat([self.audio, block])
+        self.total += len(block)
+        self.arrivals.append((self.total, time.time()))
+
+        lines = []
+        if self._is_speech(block):
+            if self.region_start is None:
+                self.region_start = block_start
+                self.num_windows = 0
+                self.seg = [block_start, block_start, -1]
+            lines += self._run_windows()
+        elif self.region_start is not None:
+            lines += self._close_region(block_start)
+        self._prune()
+        return lines
+
+    def close(self):
+        """finish the stream and return the remaining TSV lines"""
+        lines = []
+        if self.region_start is not None:
+            lines += self._close_region(self.total / self.sr)
+        return lines
+
+
+def stream_main(
+    in_wav="-",
+    out_tsv="",
+    st_model_size="small",
+    st_backend="whisper",
+    spk_backend="ecapa",
+    model_dir="",
+    beam_size=5,
+    num_speakers=-1,
+    max_num_speakers=6,
+    window_size=1.2,
+    window_shift=0.6,
+    apply_VAD=True,
+    max_segment_sec=20.0,
+    vad_threshold=0.5,
+    poll_interval=0.2,
+    idle_timeout=5.0,
+):
+    """streaming diarize->translate
+
+    Reads 16 kHz mono 16-bit PCM from stdin (`in_wav="-"`) or from a wav file
+    that may still be being written, and writes TSV lines to `out_tsv` (or
+    stdout) as soon as they are stable. The emission latency of every line
+    and the real time factor are logged to stderr. `st_backend` and
+    `spk_backend` select the models and `model_dir` a local snapshot of them
+    as in `diarist_baseline_dt`.
+    """
+    from diarist.baseline.backends import check_backends
+
+    check_backends(st_backend, spk_backend)
+    import torch
+
+    torch.manual_seed(777)
+    torch.cuda.manual_seed(777)
+    st_model, spk_model, vad_model = load_models(
+        0, st_model_size, apply_VAD, st_backend, spk_backend, model_dir
+    )
+    stream = StreamingDiarizeTranslate(
+        st_model,
+        spk_model,
+        vad_model=vad_model,
+        beam_size=beam_size,
+        num_speakers=num_speakers,
+        max_num_speakers=max_num_speakers,
+        window_size=window_size,
+        window_shift=window_shift,
+        max_segment_sec=max_segment_sec,
+        vad_threshold=vad_threshold,
+    )
+
+    block_len = int(window_shift * stream.sr)
+    if in_wav == "-":
+        blocks = read_stdin(block_len)
+    else:
+        blocks = read_growing_wav(in_wav, block_len, poll_interval, idle_timeout)
+
+    if out_tsv != "" and os.path.dirname(out_tsv) != "":
+        os.makedirs(os.path.dirname(out_tsv), exist_ok=True)
+    out = sys.stdout if out_tsv == "" else open(out_tsv, "w")
+    busy = 0.0
+    try:
+        for data in blocks:
+            block = torch.from_numpy(np.frombuffer(data, dtype="<i2") / 32768.0)
+            start = time.time()
+            lines = stream.feed(block.float())
+            busy += time.time() - start
+            for line in lines:
+                print(line, file=out, flush=True)
+        start = time.time()
+        lines = stream.close()
+        busy += time.time() - start
+        for line in lines:
+            print(line, file=out, flush=True)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    duration = stream.total / stream.sr
+    print(f"Processed {duration:.1f}s of audio in {busy:.1f}s", file=sys.stderr)
+    if duration > 0:
+        print(f"RTF: {busy / duration:.3f}", file=sys.stderr)
+    if len(stream.latencies) > 0:
+        latencies = np.array(stream.latencies)
+        print(
+            f"Latency: mean {latencies.mean():.2f}s, "
+            f"p90 {np.percentile(latencies, 90):.2f}s, max {latencies.max():.2f}s",
+            file=sys.stderr,
+        )
+
+
+def main():
+    fire.Fire(stream_main)
+
+
+if __name__ == "__main__":
+    fire.Fire(stream_main)
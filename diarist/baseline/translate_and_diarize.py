@@ -1,15 +1,24 @@
 #!/usr/bin/env python3
 
 import os
+import time
 
 import fire
-import torch
-import torchaudio
-import whisper
-from speechbrain.pretrained import EncoderClassifier
 
-from diarist.baseline.utils import get_frame, get_list, dump_result
-from diarist.baseline.clustering import clustering
+# torch and the modules importing it are imported by the functions that use
+# them, so that --help and argument errors do not wait for them
+from diarist.result_store import ResultStore
+from diarist.profiling import Profiler, NULL_TRACE
+
+
+def load_sample(in_wav, trace=NULL_TRACE):
+    """load audio"""
+    from diarist.baseline.audio import load_audio
+
+    with trace.span("load"):
+        audio, sr = load_audio(in_wav)
+    trace.audio_sec = audio.shape[1] / sr
+    return audio, sr
 
 
 def process_one_sample(
@@ -20,38 +29,70 @@ def process_one_sample(
     condition_on_previous_text=False,
     num_speakers=-1,
     max_num_speakers=6,
+    max_num_anchors=0,
     min_dur=0.8,
+    batch_size=64,
+    emb_cache=None,
+    st_cache=None,
+    sample=None,
+    trace=NULL_TRACE,
 ):
-    """process_one_sample"""
+    """process_one_sample
+
+    `sample` is the output of `load_sample`, loaded here if not given.
+    The time of each stage is added to `trace` (see `diarist.profiling`).
+    Speaker embeddings are reused from `emb_cache` (an `EmbeddingCache`) and
+    translations from `st_cache` (a `TranslationCache`) if given.
+    """
+    import torch
+    from diarist.baseline.utils import get_frame
+    from diarist.baseline.audio import to_float32
+    from diarist.baseline.cache import cached_embed_frames, cached_transcribe
+    from diarist.baseline.clustering import clustering
 
     torch.manual_seed(777)
     torch.cuda.manual_seed(777)
 
-    # Speech translation
+    if sample is None:
+        sample = load_sample(in_wav, trace)
+    audio, sr = sample
+
+    # Speech translation on the decoded audio
     decode_options = {
         "task": "translate",
         "beam_size": beam_size,
         "condition_on_previous_text": condition_on_previous_text,
     }
-    st_result = st_model.transcribe(in_wav, **decode_options)
+    with trace.span("st"):
+        st_result = cached_transcribe(
+            st_model, in_wav, decode_options, st_cache, audio=to_float32(audio[0])
+        )
 
     # Speaker embedding extraction
-    audio, sr = torchaudio.load(in_wav)
-    assert sr == 16000
-    assert audio.shape[0] == 1
 
     # extract speaker embedding with minimum duration of [min_dur] sec for each segment
-    emb_list = []
-    for i, res in enumerate(st_result["segments"]):
-        start_fr, end_fr = get_frame(res["start"], res["end"], audio.shape[1], min_dur)
-        embedding = spk_model.encode_batch(audio[0, start_fr:end_fr]).reshape(-1)
-        emb_list.append(embedding)
-    stacked_embedding = torch.stack(emb_list)
+    frames = [
+        get_frame(res["start"], res["end"], audio.shape[1], min_dur)
+        for res in st_result["segments"]
+    ]
+    with trace.span("embedding"):
+        stacked_embedding = cached_embed_frames(
+            spk_model,
+            audio[0],
+            frames,
+            in_wav,
+            batch_size=batch_size,
+            emb_cache=emb_cache,
+        )
 
     # clustering
-    clust_result = clustering(
-        stacked_embedding, num_speakers=num_speakers, max_num_speakers=max_num_speakers
-    )
+    with trace.span("clustering"):
+        clust_result = clustering(
+            stacked_embedding,
+            num_speakers=num_speakers,
+            max_num_speakers=max_num_speakers,
+            max_num_anchors=max_num_anchors,
+        )
 
     diar_result = []
     for i, res in enumerate(st_result["segments"]):
@@ -63,60 +104,217 @@ def process_one_sample(
     return diar_result
 
 
+def load_models(
+    rank=0,
+    st_model_size="small",
+    st_backend="whisper",
+    spk_backend="ecapa",
+    model_dir="",
+):
+    """load the ST and speaker embedding models of the selected backends
+
+    With `model_dir`, the models are loaded from a diarist_snapshot directory.
+    """
+    import torch
+    from diarist.baseline.backends import load_st_backend, load_spk_backend
+
+    device = "cpu"
+    if torch.cuda.is_available():
+        device = f"cuda:{rank % torch.cuda.device_count()}"
+    st_model = load_st_backend(st_backend, st_model_size, device, model_dir)
+    spk_model = load_spk_backend(spk_backend, device, model_dir)
+    return st_model, spk_model
+
+
+def _process_job(models, job):
+    """process one file in a worker of `run_worker_pool`"""
+    from diarist.baseline.utils import dump_result
+
+    in_wav, out_tsv, options, result_store, profiler = job
+    st_model, spk_model = models
+    trace = profiler.trace(in_wav)
+    print(f"Processing {in_wav}")
+    diar_result = process_one_sample(
+        in_wav, st_model, spk_model, trace=trace, **options
+    )
+    print(f"Generate {out_tsv}")
+    with trace.span("write"):
+        dump_result(diar_result, out_tsv, result_store)
+    profiler.finish(trace)
+
+
 def translate_and_diarize_main(
     in_wav="",
     out_tsv="",
     in_dir="",
     out_dir="",
+    result_store="",
+    ali_meeting_dir="",
+    subset="dev",
+    condition="SDM",
     st_model_size="small",
+    st_backend="whisper",
+    spk_backend="ecapa",
+    model_dir="",
     beam_size=5,
     num_speakers=-1,
     max_num_speakers=6,
+    max_num_anchors=0,
     min_dur=0.8,
+    batch_size=64,
+    prefetch=2,
+    emb_cache_dir="",
+    st_cache_dir="",
+    num_workers=1,
+    num_threads=0,
+    trace_file="",
     rank=0,
     world_size=1,
 ):
-    """main"""
+    """main
+
+    With `result_store`, the results are added to that single file (see
+    `ResultStore`) instead of being written as tsv files, and `out_tsv` and
+    `out_dir` are optional.
+
+    With `ali_meeting_dir`, the mini-sessions of `subset` in `condition`
+    (SDM, IHM-MIX or IHM-CAT) are synthesized from the raw AliMeeting files
+    with `DiariSTDataset` instead of reading the generated wav files.
+
+    With `num_workers` > 1, files are processed longest first by a local
+    pool of workers, each loading the models once and using `num_threads`
+    intra-op threads (by default the CPU cores are split between workers).
+    `st_backend` and `spk_backend` select the ST and speaker models, e.g.
+    "whisper-int8" and "ecapa-jit" for CPU inference (see
+    `diarist.baseline.backends`). With `model_dir`, the models are loaded
+    from a local snapshot written by diarist_snapshot, without network access.
+    Speaker embeddings and translations are stored in and reused from
+    `emb_cache_dir` and `st_cache_dir` if given, e.g. to sweep `min_dur` or the
+    clustering parameters.
+
+    With `trace_file`, the time of each stage (load, st, embedding,
+    clustering, write), the audio duration and the peak memory are written
+    there as one JSON line per file, and the real time factor and the share
+    of each stage are printed at the end.
+    """
+    from diarist.baseline.backends import check_backends, spk_model_id, st_fp16
+
+    # before importing torch, so that a wrong name fails fast
+    check_backends(st_backend, spk_backend)
+
+    import torch
+    from diarist.baseline.utils import (
+        get_list,
+        sort_by_duration,
+        dump_result,
+        result_exists,
+        run_pipeline,
+        run_worker_pool,
+    )
+    from diarist.baseline.cache import EmbeddingCache, TranslationCache
+    from diarist.baseline.translation import st_model_id
+
     torch.manual_seed(777)
     torch.cuda.manual_seed(777)
 
-    # set model
-    if torch.cuda.is_available():
-        st_model = whisper.load_model(st_model_size, device=f"cuda:{rank}")
-        spk_model = EncoderClassifier.from_hparams(
-            source="speechbrain/spkrec-ecapa-voxceleb",
-            run_opts={"device": f"cuda:{rank}"},
+    options = {
+        "beam_size": beam_size,
+        "num_speakers": num_speakers,
+        "max_num_speakers": max_num_speakers,
+        "max_num_anchors": max_num_anchors,
+        "min_dur": min_dur,
+        "batch_size": batch_size,
+        "emb_cache": None,
+        "st_cache": None,
+    }
+
+    if emb_cache_dir != "":
+        options["emb_cache"] = EmbeddingCache(emb_cache_dir, spk_model_id(spk_backend))
+    if st_cache_dir != "":
+        options["st_cache"] = TranslationCache(
+            st_cache_dir, st_model_id(st_model_size, st_backend, st_fp16(st_backend))
+        )
+
+    # set input and output
+    result_store = ResultStore(result_store) if result_store != "" else None
+    if ali_meeting_dir != "":
+        from diarist.data.dataset import get_dataset_list
+
+        in_wav_list, out_tsv_list = get_dataset_list(
+            ali_meeting_dir,
+            subset,
+            condition,
+            out_dir,
+            rank=rank,
+            world_size=world_size,
         )
     else:
-        st_model = whisper.load_model(st_model_size)
-        spk_model = EncoderClassifier.from_hparams(
-            source="speechbrain/spkrec-ecapa-voxceleb"
+        in_wav_list, out_tsv_list = get_list(
+            in_wav,
+            out_tsv,
+            in_dir,
+            out_dir,
+            rank,
+            world_size,
+            named_only=result_store is not None,
         )
+    if num_workers > 1:
+        in_wav_list, out_tsv_list = sort_by_duration(in_wav_list, out_tsv_list)
 
-    # set input and output
-    in_wav_list, out_tsv_list = get_list(
-        in_wav, out_tsv, in_dir, out_dir, rank, world_size
+    def pending():
+        for _in_wav, _out_tsv in zip(in_wav_list, out_tsv_list):
+            if result_exists(_out_tsv, result_store):
+                print(f"{_out_tsv} already exists. Skip.")
+                continue
+            yield _in_wav, _out_tsv
+
+    profiler = Profiler(trace_file)
+    profiler.start()
+    if num_workers > 1:
+        jobs = [
+            (_in_wav, _out_tsv, options, result_store, profiler)
+            for _in_wav, _out_tsv in pending()
+        ]
+        start = time.time()
+        run_worker_pool(
+            load_models,
+            (st_model_size, st_backend, spk_backend, model_dir),
+            _process_job,
+            jobs,
+            num_workers,
+            num_threads=num_threads,
+        )
+        profiler.summary(time.time() - start)
+        return
+
+    # set model
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    st_model, spk_model = load_models(
+        rank, st_model_size, st_backend, spk_backend, model_dir
     )
 
-    # process files
-    for _in_wav, _out_tsv in zip(in_wav_list, out_tsv_list):
-        if os.path.exists(_out_tsv):
-            print(f"{_out_tsv} already exists. Skip.")
-            continue
+    # process files, loading the next files and writing results in the
+    # background
+    def load(item):
+        print(f"Processing {item[0]}")
+        return load_sample(item[0], item[2])
 
-        print(f"Processing {_in_wav}")
-        diar_result = process_one_sample(
-            _in_wav,
-            st_model,
-            spk_model,
-            beam_size=beam_size,
-            num_speakers=num_speakers,
-            max_num_speakers=max_num_speakers,
-            min_dur=min_dur,
+    def process(item, sample):
+        return process_one_sample(
+            item[0], st_model, spk_model, sample=sample, trace=item[2], **options
         )
 
-        print(f"Generate {_out_tsv}")
-        dump_result(diar_result, _out_tsv)
+    def write(item, diar_result):
+        print(f"Generate {item[1]}")
+        with item[2].span("write"):
+            dump_result(diar_result, item[1], result_store)
+        profiler.finish(item[2])
+
+    items = ((w, o, profiler.trace(w)) for w, o in pending())
+    start = time.time()
+    run_pipeline(items, load, process, write, prefetch=prefetch)
+    profiler.summary(time.time() - start)
 
 
 def main():
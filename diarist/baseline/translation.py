@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+from collections import defaultdict
+
+import torch
+
+# defaults of whisper.transcribe
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+_batched_beam_search = True
+
+
+def st_model_id(st_model_size, st_backend="whisper", fp16=False):
+    """identity of a whisper model in the translation cache
+
+    fp16 (GPU) and fp32 (CPU) decoding give different translations, so the
+    precision is part of the identity.
+    """
+    import whisper
+
+    model_id = f"whisper-{whisper.__version__}-{st_model_size}"
+    if st_backend != "whisper":
+        model_id += f"-{st_backend}"
+    return model_id + ("-fp16" if fp16 else "-fp32")
+
+
+def _get_tokenizer(st_model):
+    from whisper.tokenizer import get_tokenizer
+
+    kwargs = {}
+    if hasattr(st_model, "num_languages"):
+        kwargs["num_languages"] = st_model.num_languages
+    return get_tokenizer(st_model.is_multilingual, **kwargs)
+
+
+def _is_final(result, tokenizer):
+    """whether transcribe() would stop after this first decode and keep all its tokens
+
+    That is the case when no temperature fallback or no-speech skip can be
+    triggered, and the timestamps do not make transcribe() seek back into
+    the window or drop an instantaneous segment.
+    """
+    if result.compression_ratio > COMPRESSION_RATIO_THRESHOLD:
+        return False
+    if result.avg_logprob < LOGPROB_THRESHOLD:
+        return False
+    if result.no_speech_prob > NO_SPEECH_THRESHOLD:
+        return False
+
+    tokens = torch.tensor(result.tokens, dtype=torch.long)
+    timestamp_tokens = tokens.ge(tokenizer.timestamp_begin)
+    consecutive = torch.where(timestamp_tokens[:-1] & timestamp_tokens[1:])[0] + 1
+    if len(consecutive) == 0:
+        return True
+    if timestamp_tokens[-2:].tolist() != [False, True]:
+        return False
+    slices = [0] + consecutive.tolist() + [len(tokens)]
+    for start, end in zip(slices[:-1], slices[1:]):
+        if tokens[start] == tokens[end - 1]:
+            return False
+    return True
+
+
+def _decode(st_model, features, options):
+    """beam search over a batch of encoded windows
+
+    Some whisper releases do not expand the audio features to the beams of
+    a batch, in which case the windows are decoded one by one from the
+    batched encoder output.
+    """
+    import whisper
+
+    global _batched_beam_search
+    if _batched_beam_search or len(features) == 1:
+        try:
+            return whisper.decode(st_model, features, options)
+        except RuntimeError:
+            if len(features) == 1:
+                raise
+            _batched_beam_search = False
+    return [whisper.decode(st_model, f[None], options)[0] for f in features]
+
+
+def translate_segments(
+    st_model,
+    clips,
+    beam_size=5,
+    condition_on_previous_text=False,
+    batch_size=8,
+):
+    """translate audio clips, returning the text of `st_model.transcribe` for each
+
+    Clips that fit into one 30 s window are encoded and beam-searched in
+    batches of up to `batch_size`, grouped by their detected language. Every
+    clip keeps its own beams and finishes independently. A batched result is
+    used only when transcribe() would have returned it unchanged; all other
+    clips (long clips, temperature fallback, silence, ...) are translated
+    with `st_model.transcribe` as before. Clips may come from several files.
+    """
+    import whisper
+    from whisper.audio import N_FRAMES, N_SAMPLES, log_mel_spectrogram, pad_or_trim
+
+    decode_options = {
+        "task": "translate",
+        "beam_size": beam_size,
+        "condition_on_previous_text": condition_on_previous_text,
+    }
+    fp16 = st_model.device != torch.device("cpu")
+    dtype = torch.float16 if fp16 else torch.float32
+    tokenizer = _get_tokenizer(st_model)
+
+    # mel features padded with 30 s of silence, as in transcribe()
+    mels = {}
+    for i, clip in enumerate(clips):
+        mel = log_mel_spectrogram(clip, st_model.dims.n_mels, padding=N_SAMPLES)
+        content_frames = mel.shape[-1] - N_FRAMES
+        if 0 < content_frames <= N_FRAMES:
+            mels[i] = mel
+
+    texts = [None] * len(clips)
+    indices = list(mels.keys())
+    for b in range(0, len(indices), batch_size):
+        batch_indices = indices[b : b + batch_size]
+
+        # language detection on the first 30 s of the padded features
+        lang2idx = defaultdict(list)
+        if st_model.is_multilingual:
+            mel_batch = torch.stack(
+                [pad_or_trim(mels[i], N_FRAMES) for i in batch_indices]
+            )
+            _, probs = st_model.detect_language(mel_batch.to(st_model.device).to(dtype))
+            for i, prob in zip(batch_indices, probs):
+                lang2idx[max(prob, key=prob.get)].append(i)
+        else:
+            lang2idx["en"] = batch_indices
+
+        for language, lang_indices in lang2idx.items():
+            mel_batch = torch.stack(
+                [pad_or_trim(mels[i][:, :-N_FRAMES], N_FRAMES) for i in lang_indices]
+            )
+            with torch.no_grad():
+                features = st_model.embed_audio(mel_batch.to(st_model.device).to(dtype))
+            options = whisper.DecodingOptions(
+                task="translate",
+                language=language,
+                temperature=0.0,
+                beam_size=beam_size,
+                fp16=fp16,
+            )
+            for i, result in zip(lang_indices, _decode(st_model, features, options)):
+                if _is_final(result, tokenizer):
+                    texts[i] = tokenizer.decode(result.tokens)
+
+    for i, clip in enumerate(clips):
+        if texts[i] is None:
+            texts[i] = st_model.transcribe(clip, **decode_options)["text"]
+    return texts
@@ -3,6 +3,18 @@
 import os
 import glob
 import re
+import time
+import wave
+import queue
+import threading
+import multiprocessing as mp
+from functools import partial
+from collections import defaultdict
+
+import torch
+
+from diarist.baseline.audio import to_float32
+from diarist.result_store import session_name
 
 
 def get_frame(start_sec, end_sec, audio_len, min_dur, sr=16000):
@@ -24,15 +36,63 @@ def get_frame(start_sec, end_sec, audio_len, min_dur, sr=16000):
     return start_fr, end_fr
 
 
-def get_list(in_wav="", out_tsv="", in_dir="", out_dir="", rank=0, world_size=8):
-    """get list of input wav and outpu tsv files"""
+def get_window_frames(boundaries, audio_len, window_size, window_shift, sr=16000):
+    """frames of the sliding windows over each boundary, in extraction order"""
+    frames = []
+    for boundary_start, boundary_end in boundaries:
+        boundary_dur = boundary_end - boundary_start
+        num_shift = int(boundary_dur / window_shift)
+        for i in range(num_shift):
+            start_sec = boundary_start + window_shift * i
+            frames.append(
+                get_frame(
+                    start_sec, start_sec + window_size, audio_len, window_size, sr
+                )
+            )
+    return frames
+
+
+def embed_frames(spk_model, audio, frames, batch_size=64):
+    """speaker embeddings of audio[start_fr:end_fr] for each frame pair
+
+    Frames of the same length are stacked into batches of up to
+    `batch_size`, so every window is encoded without padding, exactly as if
+    it were passed to `encode_batch` alone.
+    """
+    len2idx = defaultdict(list)
+    for i, (start_fr, end_fr) in enumerate(frames):
+        len2idx[end_fr - start_fr].append(i)
+
+    emb_list = [None] * len(frames)
+    for length, indices in len2idx.items():
+        offsets = torch.arange(length)
+        for b in range(0, len(indices), batch_size):
+            batch_indices = indices[b : b + batch_size]
+            starts = torch.tensor([frames[i][0] for i in batch_indices])
+            wavs = to_float32(audio[starts[:, None] + offsets])
+            embeddings = spk_model.encode_batch(wavs).reshape(len(batch_indices), -1)
+            for i, embedding in zip(batch_indices, embeddings):
+                emb_list[i] = embedding
+    return emb_list
+
+
+def get_list(
+    in_wav="", out_tsv="", in_dir="", out_dir="", rank=0, world_size=8, named_only=False
+):
+    """get list of input wav and outpu tsv files
+
+    With `named_only`, out_tsv and out_dir may be empty, as the tsv files are
+    only used to name the results (e.g. in a `ResultStore`).
+    """
 
     in_wav_list = []
     out_tsv_list = []
-    if in_wav != "" and out_tsv != "":
+    if in_wav != "" and (out_tsv != "" or named_only):
         in_wav_list = [in_wav]
+        if out_tsv == "":
+            out_tsv = f"{os.path.splitext(os.path.basename(in_wav))[0]}.tsv"
         out_tsv_list = [out_tsv]
-    elif in_dir != "" and out_dir != "":
+    elif in_dir != "" and (out_dir != "" or named_only):
         in_wav_list = sorted(glob.glob(f"{in_dir}/**/*.wav", recursive=True))
         in_wav_list = [x for i, x in enumerate(in_wav_list) if i % world_size == rank]
 
@@ -44,8 +104,43 @@ def get_list(in_wav="", out_tsv="", in_dir="", out_dir="", rank=0, world_size=8)
     return in_wav_list, out_tsv_list
 
 
-def dump_result(diar_result, out_tsv):
-    """dump_result"""
+def get_duration(in_wav):
+    """duration in seconds from the wav header, or from soundfile for other files
+
+    Files whose duration can't be read count as 0.0 s, with a warning.
+    """
+    if not isinstance(in_wav, str):
+        # a DiariSTDataset mini-session
+        return in_wav.duration
+    try:
+        with wave.open(in_wav, "rb") as f:
+            return f.getnframes() / f.getframerate()
+    except (wave.Error, EOFError):
+        pass
+    try:
+        import soundfile
+
+        return soundfile.info(in_wav).duration
+    except Exception as err:
+        print(f"Warning: can't read the duration of {in_wav} ({err}), using 0.0 s")
+        return 0.0
+
+
+def sort_by_duration(in_wav_list, out_tsv_list):
+    """sort input and output files from the longest input to the shortest"""
+    durations = [get_duration(_in_wav) for _in_wav in in_wav_list]
+    order = sorted(range(len(in_wav_list)), key=lambda i: -durations[i])
+    return [in_wav_list[i] for i in order], [out_tsv_list[i] for i in order]
+
+
+def dump_result(diar_result, out_tsv, result_store=None):
+    """dump_result
+
+    With a `ResultStore`, the result is added to it instead, named after out_tsv.
+    """
+    if result_store is not None:
+        result_store.put(session_name(out_tsv), diar_result)
+        return
 
     out_dir = os.path.dirname(out_tsv)
     if not os.path.exists(out_dir) and out_dir != "":
@@ -53,3 +148,136 @@ def dump_result(diar_result, out_tsv):
     with open(out_tsv, "w", encoding="utf-8") as out_f:
         for res in diar_result:
             out_f.write(f"{res}\n")
+
+
+def result_exists(out_tsv, result_store=None):
+    """whether the result of out_tsv is already written, or in the `ResultStore`"""
+    if result_store is not None:
+        return session_name(out_tsv) in result_store
+    return os.path.exists(out_tsv)
+
+
+def run_pipeline(items, load_fn, process_fn, write_fn, prefetch=2):
+    """run load_fn -> process_fn -> write_fn over items with overlapping stages
+
+    load_fn runs in a background thread up to `prefetch` items ahead of
+    process_fn, and write_fn runs in another background thread, so only
+    process_fn (model inference) runs on the calling thread. `items` is
+    consumed lazily by the loader. With prefetch=0 the stages run in turn.
+    """
+    if prefetch <= 0:
+        for item in items:
+            write_fn(item, process_fn(item, load_fn(item)))
+        return
+
+    end = object()
+    stop = threading.Event()
+    load_queue = queue.Queue(maxsize=prefetch)
+    write_queue = queue.Queue(maxsize=prefetch)
+    errors = []
+
+    def loader():
+        try:
+            for item in items:
+                if stop.is_set():
+                    break
+                load_queue.put((item, load_fn(item)))
+        except Exception as err:
+            errors.append(err)
+        load_queue.put(end)
+
+    def writer():
+        while True:
+            entry = write_queue.get()
+            if entry is end:
+                break
+            try:
+                write_fn(*entry)
+            except Exception as err:
+                errors.append(err)
+                stop.set()
+
+    load_thread = threading.Thread(target=loader, daemon=True)
+    write_thread = threading.Thread(target=writer, daemon=True)
+    load_thread.start()
+    write_thread.start()
+    try:
+        while not stop.is_set():
+            entry = load_queue.get()
+            if entry is end:
+                break
+            item, loaded = entry
+            write_queue.put((item, process_fn(item, loaded)))
+    finally:
+        # stop the loader, unblocking it if it waits on a full queue, and
+        # flush the results processed so far
+        stop.set()
+        while load_thread.is_alive():
+            try:
+                load_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        write_queue.put(end)
+        write_thread.join()
+    if errors:
+        raise errors[0]
+
+
+_worker_state = {}
+
+
+def _init_worker(init_fn, init_args, num_threads):
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+        torch.set_num_interop_threads(1)
+    # pool workers are numbered from 1
+    worker_index = mp.current_process()._identity[0] - 1
+    _worker_state["state"] = init_fn(worker_index, *init_args)
+    _worker_state["ready"] = time.time()
+
+
+def _run_job(job_fn, job):
+    start = time.time()
+    job_fn(_worker_state["state"], job)
+    return os.getpid(), _worker_state["ready"], time.time() - start
+
+
+def run_worker_pool(init_fn, init_args, job_fn, jobs, num_workers, num_threads=0):
+    """run job_fn(state, job) for each job over a local process pool
+
+    Every worker builds its state (e.g. models) once with
+    init_fn(worker_index, *init_args). Jobs are handed out one at a time in
+    the given order, so passing them longest first balances the workers.
+    `num_threads` pins the intra-op threads of each worker; by default the
+    CPU cores are split between workers when CUDA is not available.
+    """
+    if num_threads <= 0 and not torch.cuda.is_available():
+        num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+
+    start = time.time()
+    busy = defaultdict(float)
+    num_jobs = defaultdict(int)
+    ready = {}
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(
+        num_workers,
+        initializer=_init_worker,
+        initargs=(init_fn, init_args, num_threads),
+    ) as pool:
+        for pid, ready_time, elapsed in pool.imap_unordered(
+            partial(_run_job, job_fn), jobs, chunksize=1
+        ):
+            busy[pid] += elapsed
+            num_jobs[pid] += 1
+            ready[pid] = ready_time
+    end = time.time()
+
+    # utilisation is measured from the time each worker has loaded its models
+    print(
+        f"Processed {len(jobs)} files with {num_workers} workers in {end - start:.1f}s"
+    )
+    for pid in sorted(busy):
+        print(
+            f"  worker {pid}: {num_jobs[pid]} files, load {ready[pid] - start:.1f}s, "
+            f"busy {busy[pid]:.1f}s ({100 * busy[pid] / (end - ready[pid]):.1f}%)"
+        )
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import torch
+import whisper
+
+
+class StubSpeakerModel(torch.nn.Module):
+    """randomly initialized stand-in for the ECAPA speaker model
+
+    Takes (B, T) waveforms like `EncoderClassifier.encode_batch` and returns
+    (B, 1, emb_dim) embeddings. Log filterbank features, normalized over the
+    bands of each frame, go through `num_blocks` residual dilated
+    convolutions of `channels` channels and statistics pooling, which costs
+    about as much compute as ECAPA-TDNN. The residual path keeps the spectral
+    shape, so the embeddings still tell the speakers of `synthetic_audio`
+    apart.
+    """
+
+    def __init__(self, channels=512, num_blocks=3, emb_dim=192, n_mels=80, seed=0):
+        super().__init__()
+        generator = torch.Generator().manual_seed(seed)
+        self.device = torch.device("cpu")
+        self.register_buffer("window", torch.hann_window(400))
+        # rectangular filterbank of n_mels bands over the 201 stft bins
+        edges = torch.linspace(0, 201, n_mels + 1).long()
+        fbank = torch.zeros(n_mels, 201)
+        for m in range(n_mels):
+            fbank[m, edges[m] : max(edges[m + 1], edges[m] + 1)] = 1.0
+        self.register_buffer("fbank", fbank)
+        self.inp = torch.nn.Conv1d(n_mels, channels, 1)
+        self.blocks = torch.nn.ModuleList(
+            torch.nn.Conv1d(channels, channels, 3, dilation=d, padding=d)
+            for d in range(2, 2 + num_blocks)
+        )
+        self.out = torch.nn.Linear(2 * channels, emb_dim)
+        for param in self.parameters():
+            param.data = torch.randn(param.shape, generator=generator) * 0.05
+        self.eval()
+
+    def encode_batch(self, wavs):
+        with torch.no_grad():
+            spec = torch.stft(
+                wavs, 400, 160, window=self.window, return_complex=True
+            ).abs()
+            feats = torch.log(self.fbank @ spec.pow(2) + 1e-6)
+            feats = feats - feats.mean(dim=1, keepdim=True)
+            x = self.inp(feats)
+            for block in self.blocks:
+                x = x + 0.1 * torch.relu(block(x))
+            stats = torch.cat([x.mean(dim=2), x.std(dim=2)], dim=1)
+            return self.out(stats)[:, None]
+
+
+def stub_st_model(seed=0, n_text_ctx=64):
+    """randomly initialized whisper with the dimensions of "tiny"
+
+    Needs no download and encodes audio at the cost of the real model. Its
+    random output is rarely confident, so most clips also go through the
+    temperature fallback of `transcribe`. The text context is shortened to
+    `n_text_ctx` tokens, which bounds the length of each decode.
+    """
+    torch.manual_seed(seed)
+    dims = whisper.model.ModelDimensions(
+        n_mels=80,
+        n_audio_ctx=1500,
+        n_audio_state=384,
+        n_audio_head=6,
+        n_audio_layer=4,
+        n_vocab=51865,
+        n_text_ctx=n_text_ctx,
+        n_text_state=384,
+        n_text_head=6,
+        n_text_layer=4,
+    )
+    model = whisper.model.Whisper(dims).eval()
+    # whisper leaves it uninitialized, as it is always loaded from a checkpoint
+    torch.nn.init.normal_(model.decoder.positional_embedding, std=0.02)
+    return model
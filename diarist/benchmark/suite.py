@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+import io
+import sys
+import json
+import time
+import platform
+import tempfile
+import contextlib
+
+import fire
+import numpy as np
+import torch
+
+from diarist.baseline.utils import get_window_frames, embed_frames
+from diarist.benchmark.stub_models import StubSpeakerModel, stub_st_model
+from diarist.benchmark.synthetic import (
+    synthetic_turns,
+    synthetic_audio,
+    synthetic_reference,
+    synthetic_hypothesis,
+    synthetic_embeddings,
+    write_sessions,
+)
+from diarist.scoring.eval import sagbleu, satbleu, evaluate
+
+
+def bench_window_frames(work_dir, duration, window_size=1.2, window_shift=0.6):
+    """`get_frame` for every sliding window of a session"""
+    sr = 16000
+    boundaries = [[start, end] for _, start, end in synthetic_turns(duration, 4)]
+    return lambda: get_window_frames(
+        boundaries, int(duration * sr), window_size, window_shift, sr
+    )
+
+
+def bench_embedding(
+    work_dir, duration, num_speakers=4, window_size=1.2, window_shift=0.6
+):
+    """sliding-window speaker embedding extraction with `StubSpeakerModel`"""
+    turns = synthetic_turns(duration, num_speakers)
+    audio, sr = synthetic_audio(turns, duration, num_speakers)
+    audio = torch.from_numpy(audio)
+    spk_model = StubSpeakerModel()
+
+    def run():
+        frames = get_window_frames(
+            [[0.0, duration]], len(audio), window_size, window_shift, sr
+        )
+        return embed_frames(spk_model, audio, frames)
+
+    return run
+
+
+def bench_clustering(work_dir, duration, num_speakers, max_num_anchors=0):
+    """NMESC clustering of the embeddings of a session"""
+    from diarist.baseline.clustering import clustering
+
+    turns = synthetic_turns(duration, num_speakers)
+    embeddings, _ = synthetic_embeddings(turns, num_speakers)
+    embeddings = torch.from_numpy(embeddings)
+
+    def run():
+        torch.manual_seed(777)
+        return clustering(embeddings, max_num_anchors=max_num_anchors)
+
+    return run
+
+
+def _session(duration, num_speakers):
+    ref_json = synthetic_reference(synthetic_turns(duration, num_speakers))
+    return synthetic_hypothesis(ref_json), ref_json
+
+
+def bench_sagbleu(work_dir, duration, num_speakers):
+    """SAgBLEU of one session"""
+    preds, ref_json = _session(duration, num_speakers)
+    return lambda: sagbleu(preds, ref_json)
+
+
+def bench_satbleu(work_dir, duration, num_speakers):
+    """SAtBLEU of one session, searching the best speaker assignment"""
+    preds, ref_json = _session(duration, num_speakers)
+    return lambda: satbleu(preds, ref_json)
+
+
+def bench_evaluate(work_dir, num_files, duration=120, num_speakers=4, num_workers=1):
+    """`evaluate` of a directory of tsv files, including the file reading"""
+    ref_dir, hyp_dir = write_sessions(work_dir, num_files, duration, num_speakers)
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            evaluate(ref_dir, hyp_dir, num_workers=num_workers)
+
+    return run
+
+
+def bench_dt(work_dir, duration, num_speakers=4):
+    """diarization --> translation of a session with the stub models"""
+    from diarist.baseline.diarize_and_translate import process_one_sample
+
+    turns = synthetic_turns(duration, num_speakers)
+    audio, sr = synthetic_audio(turns, duration, num_speakers)
+    sample = (torch.from_numpy(audio)[None], sr, [[0.0, duration]])
+    st_model = stub_st_model()
+    spk_model = StubSpeakerModel()
+    return lambda: process_one_sample("", st_model, spk_model, sample=sample)
+
+
+# each benchmark takes a scratch directory and its parameters, prepares the
+# data and returns the function to time
+BENCHMARKS = {
+    "window_frames": bench_window_frames,
+    "embedding": bench_embedding,
+    "clustering": bench_clustering,
+    "sagbleu": bench_sagbleu,
+    "satbleu": bench_satbleu,
+    "evaluate": bench_evaluate,
+    "dt": bench_dt,
+}
+
+# parameters of each benchmark, from small to large
+SCALES = {
+    "small": [
+        ("window_frames", {"duration": 3600}),
+        ("window_frames", {"duration": 36000}),
+        ("embedding", {"duration": 30}),
+        ("embedding", {"duration": 120}),
+        ("clustering", {"duration": 120, "num_speakers": 2}),
+        ("clustering", {"duration": 600, "num_speakers": 4}),
+        ("sagbleu", {"duration": 600, "num_speakers": 4}),
+        ("satbleu", {"duration": 600, "num_speakers": 4}),
+        ("satbleu", {"duration": 600, "num_speakers": 12}),
+        ("evaluate", {"num_files": 20}),
+        ("evaluate", {"num_files": 100}),
+    ],
+    "full": [
+        ("window_frames", {"duration": 36000}),
+        ("window_frames", {"duration": 144000}),
+        ("embedding", {"duration": 120}),
+        ("embedding", {"duration": 600}),
+        ("clustering", {"duration": 600, "num_speakers": 4}),
+        ("clustering", {"duration": 1800, "num_speakers": 4}),
+        ("clustering", {"duration": 1800, "num_speakers": 8}),
+        ("clustering", {"duration": 3600, "num_speakers": 8, "max_num_anchors": 300}),
+        ("sagbleu", {"duration": 3600, "num_speakers": 8}),
+        ("satbleu", {"duration": 600, "num_speakers": 4}),
+        ("satbleu", {"duration": 3600, "num_speakers": 8}),
+        ("satbleu", {"duration": 3600, "num_speakers": 16}),
+        ("evaluate", {"num_files": 100}),
+        ("evaluate", {"num_files": 500}),
+    ],
+    # end to end, mostly spent decoding with the random whisper
+    "pipeline": [
+        ("dt", {"duration": 30}),
+    ],
+}
+
+
+def benchmark_key(name, params):
+    """name of a benchmark run in the result file, e.g. clustering[duration=120]"""
+    args = ",".join(f"{k}={v}" for k, v in params.items())
+    return f"{name}[{args}]"
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "num_threads": torch.get_num_threads(),
+    }
+
+
+def time_benchmark(name, params, repeat=3):
+    """seconds of `repeat` runs of a benchmark after one warm-up run"""
+    with tempfile.TemporaryDirectory(prefix="diarist_benchmark_") as work_dir:
+        run = BENCHMARKS[name](work_dir, **params)
+        run()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def run(out_json="", baseline="", scale="small", only="", repeat=3, num_threads=1):
+    """run the benchmarks of a scale on synthetic data
+
+    `only` restricts the run to a comma separated list of benchmark names.
+    The timings are written to `out_json` and, with `baseline`, compared to
+    an earlier result file (see `compare`).
+    """
+    if scale not in SCALES:
+        raise ValueError(f"Unknown scale {scale}")
+    if only == "":
+        names = list(BENCHMARKS)
+    elif isinstance(only, (list, tuple)):
+        # fire parses "a,b" into a tuple
+        names = list(only)
+    else:
+        names = only.split(",")
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError(f"Unknown benchmark {name}")
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+
+    results = {}
+    for name, params in SCALES[scale]:
+        if name not in names:
+            continue
+        key = benchmark_key(name, params)
+        times = time_benchmark(name, params, repeat=repeat)
+        results[key] = {
+            "name": name,
+            "params": params,
+            "min_sec": min(times),
+            "median_sec": float(np.median(times)),
+            "times": times,
+        }
+        print(f"{key:<60} {min(times):9.4f}s (median {np.median(times):.4f}s)")
+
+    report = {"scale": scale, "environment": environment(), "results": results}
+    if out_json != "":
+        with open(out_json, "w") as f:
+            json.dump(report, f, indent=4)
+    if baseline != "":
+        compare(baseline, report)
+
+
+def compare(baseline, current, threshold=1.2):
+    """compare the minimum run time of each benchmark to a baseline result file
+
+    Benchmarks slower than `threshold` times the baseline are reported as
+    regressions, and the process exits with status 1.
+    """
+    with open(baseline) as f:
+        base = json.load(f)["results"]
+    if isinstance(current, str):
+        with open(current) as f:
+            current = json.load(f)
+    regressions = []
+    for key, result in current["results"].items():
+        if key not in base:
+            continue
+        ratio = result["min_sec"] / base[key]["min_sec"]
+        mark = ""
+        if ratio > threshold:
+            mark = " REGRESSION"
+            regressions.append(key)
+        print(
+            f"{key:<60} {base[key]['min_sec']:9.4f}s -> "
+            f"{result['min_sec']:9.4f}s x{ratio:.2f}{mark}"
+        )
+    if len(regressions) > 0:
+        print(f"{len(regressions)} benchmarks slower than x{threshold}")
+        sys.exit(1)
+
+
+def main():
+    fire.Fire({"run": run, "compare": compare})
+
+
+if __name__ == "__main__":
+    fire.Fire({"run": run, "compare": compare})
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import os
+import json
+
+import numpy as np
+
+WORDS = (
+    "the meeting project plan budget design team market product user test data "
+    "report schedule price customer quality problem solution idea week month "
+    "we you they should could will need think agree discuss check prepare "
+    "next first last new good important main final open simple about for with "
+    "and but so because if then also very more less all some this that"
+).split()
+
+
+def synthetic_turns(duration, num_speakers, seed=0, min_turn=1.0, max_turn=6.0):
+    """(speaker, start, end) turns of a meeting, with short pauses in between"""
+    rng = np.random.default_rng(seed)
+    turns = []
+    t = rng.uniform(0.0, 0.5)
+    prev_spk = -1
+    while t + min_turn < duration:
+        spk = int(rng.integers(num_speakers))
+        if spk == prev_spk and num_speakers > 1:
+            spk = (spk + 1) % num_speakers
+        end = min(duration, t + rng.uniform(min_turn, max_turn))
+        turns.append((spk, round(t, 2), round(end, 2)))
+        t = end + rng.uniform(0.1, 0.8)
+        prev_spk = spk
+    return turns
+
+
+def synthetic_audio(turns, duration, num_speakers, seed=0, sr=16000):
+    """int16 samples of the turns, each speaker a harmonic voice of its own
+
+    Every speaker has its own pitch and spectral envelope, and the voice is
+    modulated at a syllable rate, so that the turns can be told apart by a
+    speaker model. Pauses hold low background noise.
+    """
+    rng = np.random.default_rng(seed)
+    f0 = rng.uniform(90.0, 260.0, num_speakers)
+    envelope = rng.uniform(0.2, 1.0, (num_speakers, 24))
+    audio = rng.normal(0.0, 0.003, int(duration * sr))
+    for spk, start, end in turns:
+        start_fr, end_fr = int(start * sr), int(end * sr)
+        t = np.arange(end_fr - start_fr) / sr
+        pitch = f0[spk] * (1 + 0.03 * np.sin(2 * np.pi * 5.0 * t))
+        phase = 2 * np.pi * np.cumsum(pitch) / sr
+        voice = np.zeros_like(t)
+        for k in range(1, 25):
+            if k * f0[spk] < sr / 2.5:
+                voice += envelope[spk, k - 1] / k * np.sin(k * phase)
+        syllables = 0.6 + 0.4 * np.sin(2 * np.pi * rng.uniform(3.0, 5.0) * t)
+        audio[start_fr:end_fr] += 0.1 * voice * syllables
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16), sr
+
+
+def synthetic_reference(turns, seed=0, words_per_sec=2.5):
+    """annotation of the turns in the DiariST-AliMeeting json format"""
+    rng = np.random.default_rng(seed)
+    ref_json = []
+    for spk, start, end in turns:
+        num_words = max(1, int((end - start) * words_per_sec))
+        translation = " ".join(rng.choice(WORDS, num_words))
+        ref_json.append(
+            {
+                "speaker": f"N_SPK{spk:04d}",
+                "start": start,
+                "end": end,
+                "text": "",
+                "translation": translation,
+            }
+        )
+    return ref_json
+
+
+def synthetic_hypothesis(ref_json, seed=0, word_error=0.2, speaker_error=0.1):
+    """tsv lines of a system output for the reference, with errors
+
+    Words are replaced or dropped with probability `word_error` and turns are
+    given to another speaker with probability `speaker_error`; the speaker
+    labels are renamed as a diarization system would.
+    """
+    rng = np.random.default_rng(seed)
+    speakers = sorted(set(seg["speaker"] for seg in ref_json))
+    labels = rng.permutation(len(speakers))
+    preds = []
+    for seg in ref_json:
+        spk = speakers.index(seg["speaker"])
+        if rng.random() < speaker_error:
+            spk = int(rng.integers(len(speakers)))
+        words = []
+        for word in seg["translation"].split():
+            r = rng.random()
+            if r < word_error / 2:
+                continue
+            words.append(rng.choice(WORDS) if r < word_error else word)
+        text = " ".join(words)
+        if text != "":
+            preds.append(f"guest_{labels[spk]}\t{seg['start']}\t{seg['end']}\t{text}")
+    return preds
+
+
+def synthetic_embeddings(turns, num_speakers, window_shift=0.6, dim=192, seed=0):
+    """speaker embeddings of the sliding windows over the turns
+
+    Each speaker has a random centroid, and every window gets the centroid of
+    its speaker plus noise, like the embeddings of a speaker model.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = rng.normal(0.0, 1.0, (num_speakers, dim))
+    labels = []
+    for spk, start, end in turns:
+        labels += [spk] * int((end - start) / window_shift)
+    labels = np.array(labels, dtype=np.int64)
+    embeddings = centroids[labels] + rng.normal(0.0, 0.8, (len(labels), dim))
+    return embeddings.astype(np.float32), labels
+
+
+def write_sessions(out_dir, num_sessions, duration, num_speakers, seed=0):
+    """reference json and hypothesis tsv files of synthetic sessions
+
+    Returns the reference and the hypothesis directories under `out_dir`.
+    """
+    ref_dir = os.path.join(out_dir, "ref")
+    hyp_dir = os.path.join(out_dir, "hyp")
+    os.makedirs(ref_dir, exist_ok=True)
+    os.makedirs(hyp_dir, exist_ok=True)
+    for i in range(num_sessions):
+        name = f"S{i:04d}-0-{duration}"
+        turns = synthetic_turns(duration, num_speakers, seed=seed + i)
+        ref_json = synthetic_reference(turns, seed=seed + i)
+        with open(os.path.join(ref_dir, f"{name}.json"), "w") as f:
+            json.dump(ref_json, f, ensure_ascii=False, indent=4)
+        with open(os.path.join(hyp_dir, f"{name}.tsv"), "w") as f:
+            for line in synthetic_hypothesis(ref_json, seed=seed + i):
+                f.write(f"{line}\n")
+    return ref_dir, hyp_dir
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import bisect
+
+
+def load_translation_tsv(in_tsv):
+    """utterances of a translation tsv (session, speaker, start, end, text,
+    translation), grouped by session in file order"""
+    utterances = {}
+    with open(in_tsv, "r") as f:
+        for line in f:
+            line = line.strip()
+            session, speaker, start, end, text, translation = line.split("\t")
+            utterances.setdefault(session, []).append(
+                {
+                    "start": float(start),
+                    "end": float(end),
+                    "speaker": speaker,
+                    "text": text,
+                    "translation": translation,
+                }
+            )
+    return utterances
+
+
+class AnnotationIndex:
+    """per-session interval index of utterances
+
+    The utterances of every session are sorted by start time (ties keep
+    their original order), so the utterances in a time window are found by
+    bisecting the start times instead of scanning the whole session.
+    """
+
+    def __init__(self, utterances):
+        self.utterances = {}
+        self.starts = {}
+        for session, elems in utterances.items():
+            elems = sorted(elems, key=lambda x: x["start"])
+            self.utterances[session] = elems
+            self.starts[session] = [elem["start"] for elem in elems]
+
+    @classmethod
+    def from_tsv(cls, in_tsv):
+        return cls(load_translation_tsv(in_tsv))
+
+    def sessions(self):
+        return list(self.utterances)
+
+    def starting_in(self, session, start, end):
+        """utterances of a session starting in [start, end], by start time"""
+        starts = self.starts[session]
+        lo = bisect.bisect_left(starts, start)
+        hi = bisect.bisect_right(starts, end)
+        return self.utterances[session][lo:hi]
+
+    def within(self, session, start, end):
+        """utterances of a session lying in [start, end], by start time"""
+        return [
+            elem for elem in self.starting_in(session, start, end) if elem["end"] <= end
+        ]
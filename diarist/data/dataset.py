@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from diarist.data.generate_diarist_alimeeting import (
+    ROOT_DIR,
+    CONDITIONS,
+    SessionRecordings,
+    get_condition_audio,
+    get_condition_data,
+)
+
+
+class DiariSTDataset:
+    """DiariST-AliMeeting mini-sessions synthesized from the raw AliMeeting files
+
+    Gives the same samples and annotation as the files written by
+    `generate_diarist_alimeeting.py`, without writing them. `in_json` is the
+    mini-session list made by `generate_data_json.py`. The recordings of the
+    last `cache_size` sessions and the last `cache_size` synthesized
+    mini-sessions are kept.
+    """
+
+    def __init__(self, ali_meeting_dir, subset, condition, in_json="", cache_size=4):
+        if condition not in CONDITIONS:
+            raise ValueError(f"Unknown condition {condition}")
+        self.ali_meeting_dir = ali_meeting_dir
+        self.subset = subset
+        self.condition = condition
+        self.cache_size = cache_size
+        if in_json == "":
+            in_json = f"{ROOT_DIR}/{subset}.json"
+        with open(in_json) as fp:
+            self.mini_sessions = json.load(fp)
+        self._recordings = OrderedDict()
+        self._audios = OrderedDict()
+        # the loader thread of run_pipeline and the main thread share the caches
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # caches are not sent to worker processes
+        state = self.__dict__.copy()
+        state["_recordings"] = OrderedDict()
+        state["_audios"] = OrderedDict()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.mini_sessions)
+
+    def __getitem__(self, index):
+        return DiariSTItem(self, index)
+
+    def name(self, index):
+        """basename of the materialized files of a mini-session"""
+        one_session = self.mini_sessions[index]
+        return f"{one_session['session']}-{one_session['start']}-{one_session['end']}"
+
+    def _cached(self, cache, key, load_fn):
+        with self._lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+        # loaded without the lock, since loading an audio loads its recordings
+        value = load_fn()
+        with self._lock:
+            if key in cache:
+                # loaded meanwhile by another thread
+                cache.move_to_end(key)
+                return cache[key]
+            cache[key] = value
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return value
+
+    def recordings(self, session):
+        """`SessionRecordings` of a session"""
+        return self._cached(
+            self._recordings,
+            session,
+            lambda: SessionRecordings(self.ali_meeting_dir, self.subset, session),
+        )
+
+    def audio(self, index):
+        """samples (int16 for 16-bit recordings) and sample rate of a mini-session"""
+        one_session = self.mini_sessions[index]
+        return self._cached(
+            self._audios,
+            index,
+            lambda: get_condition_audio(
+                self.condition, self.recordings(one_session["session"]), one_session
+            ),
+        )
+
+    def data(self, index):
+        """annotation of a mini-session, as in its json file"""
+        return get_condition_data(self.condition, self.mini_sessions[index])
+
+    def duration(self, index):
+        one_session = self.mini_sessions[index]
+        if self.condition == "IHM-CAT":
+            return sum(elem["end"] - elem["start"] for elem in one_session["data"])
+        return one_session["end"] - one_session["start"]
+
+
+class DiariSTItem:
+    """one mini-session of a `DiariSTDataset`
+
+    Can be passed to the baselines in place of a wav path.
+    """
+
+    def __init__(self, dataset, index):
+        self.dataset = dataset
+        self.index = index
+        self.name = dataset.name(index)
+        self._hash = None
+
+    def __str__(self):
+        dataset = self.dataset
+        return f"{ROOT_DIR}{dataset.condition}/{dataset.subset}/{self.name}.wav"
+
+    @property
+    def duration(self):
+        return self.dataset.duration(self.index)
+
+    @property
+    def data(self):
+        return self.dataset.data(self.index)
+
+    def load(self):
+        """(1, T) tensor and sample rate, as `load_audio` gives for the wav file"""
+        audio, sr = self.dataset.audio(self.index)
+        if audio.dtype != np.int16:
+            audio = audio.astype(np.float32)
+        return torch.from_numpy(audio)[None], sr
+
+    def audio_hash(self):
+        """sha1 of the samples, as a cache key"""
+        if self._hash is None:
+            audio, sr = self.dataset.audio(self.index)
+            sha1 = hashlib.sha1(f"{audio.dtype}|{sr}|".encode())
+            sha1.update(np.ascontiguousarray(audio).tobytes())
+            self._hash = sha1.hexdigest()
+        return self._hash
+
+
+def get_dataset_list(
+    ali_meeting_dir, subset, condition, out_dir, in_json="", rank=0, world_size=1
+):
+    """DiariSTItems of a subset and the output tsv file of each"""
+    dataset = DiariSTDataset(ali_meeting_dir, subset, condition, in_json=in_json)
+    items = [dataset[i] for i in range(rank, len(dataset), world_size)]
+    out_tsv_list = [os.path.join(out_dir, f"{item.name}.tsv") for item in items]
+    return items, out_tsv_list
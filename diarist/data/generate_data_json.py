@@ -3,42 +3,36 @@
 import sys
 import json
 
+from diarist.data.annotation_index import AnnotationIndex
+
+
+def dump_json_list(items, out):
+    """write items to out as `json.dumps(list(items), indent=4)` would, one at a time"""
+    out.write("[")
+    empty = True
+    for item in items:
+        out.write("\n    " if empty else ",\n    ")
+        text = json.dumps(item, indent=4, ensure_ascii=False)
+        out.write(text.replace("\n", "\n    "))
+        empty = False
+    out.write("]" if empty else "\n]")
+
 
 if __name__ == "__main__":
     in_tsv = sys.argv[1]
     in_json = sys.argv[2]
 
-    translation_data = {}
-    with open(in_tsv, "r") as f:
-        for line in f:
-            line = line.strip()
-            session, speaker, start, end, text, translation = line.split("\t")
-            if session not in translation_data:
-                translation_data[session] = []
-            translation_data[session].append(
-                {
-                    "start": float(start),
-                    "end": float(end),
-                    "speaker": speaker,
-                    "text": text,
-                    "translation": translation,
-                }
-            )
+    index = AnnotationIndex.from_tsv(in_tsv)
 
     with open(in_json, "r") as f:
         data = json.load(f)
 
+    def mini_sessions():
         for mini_session in data:
-            start = mini_session["start"]
-            end = mini_session["end"]
-            session = mini_session["session"]
-            mini_session["data"] = []
-            for elem in translation_data[session]:
-                elem_start = elem["start"]
-                elem_end = elem["end"]
-                if start <= elem_start and elem_end <= end:
-                    mini_session["data"].append(elem)
-            mini_session["data"] = sorted(
-                mini_session["data"], key=lambda x: x["start"]
+            mini_session["data"] = index.within(
+                mini_session["session"], mini_session["start"], mini_session["end"]
             )
-        print(json.dumps(data, indent=4, ensure_ascii=False))
+            yield mini_session
+
+    dump_json_list(mini_sessions(), sys.stdout)
+    sys.stdout.write("\n")
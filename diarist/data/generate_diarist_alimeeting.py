@@ -2,15 +2,21 @@
 
 import sys
 import os
+import copy
 import json
 import glob
 import re
+import multiprocessing as mp
 
 import soundfile as sf
 import numpy as np
 
+from diarist.wavfile import WavFile
+
 ROOT_DIR = "data/DiariST-AliMeeting/"
 SUBSETS = ["dev", "test"]
+CONDITIONS = ["SDM", "IHM-MIX", "IHM-CAT"]
+SUBSET_DIRS = {"dev": "Eval_Ali", "test": "Test_Ali"}
 
 
 def fix_timing(data, start):
@@ -21,201 +27,200 @@ def fix_timing(data, start):
     return data
 
 
-def gen_sdm(in_json, ali_meeting_dir, subset):
-    """generate single distant microphone data"""
-    with open(in_json) as fp:
-        all_data = json.load(fp)
-
-    prev_session = ""
-    for one_session in all_data:
-        session = one_session["session"]
-        data = one_session["data"]
-        start = one_session["start"]
-        end = one_session["end"]
-
-        if prev_session != session:
-            if subset == "dev":
-                audio_files = glob.glob(
-                    f"{ali_meeting_dir}/Eval_Ali/Eval_Ali_far/audio_dir/{session}_*.wav"
-                )
-            elif subset == "test":
-                audio_files = glob.glob(
-                    f"{ali_meeting_dir}/Test_Ali/Test_Ali_far/audio_dir/{session}_*.wav"
-                )
-            assert len(audio_files) == 1
-            audio_file = audio_files[0]
-
-            audio, sr = sf.read(audio_file)
-        prev_session = session
-
-        out_wav = f"{ROOT_DIR}/SDM/{subset}/{session}-{start}-{end}.wav"
-        out_json = f"{ROOT_DIR}/SDM/{subset}/{session}-{start}-{end}.json"
-        mkdir = os.path.dirname(out_wav)
-        if not os.path.exists(mkdir):
-            os.makedirs(mkdir, exist_ok=True)
-
+def concat_timing(data):
+    """timing of the utterances once they are concatenated"""
+    new_data = []
+    new_start = 0
+    new_end = 0
+    for elem in data:
+        start = elem["start"]
+        end = elem["end"]
+        new_start = new_end
+        new_end = new_start + end - start
+        new_data.append(
+            {
+                "speaker": elem["speaker"],
+                "start": new_start,
+                "end": new_end,
+                "text": elem["text"],
+                "translation": elem["translation"],
+            }
+        )
+    return new_data
+
+
+def get_audio_files(ali_meeting_dir, subset, session, field):
+    """far or near field audio files of a session"""
+    subset_dir = SUBSET_DIRS[subset]
+    return glob.glob(
+        f"{ali_meeting_dir}/{subset_dir}/{subset_dir}_{field}/audio_dir/{session}_*.wav"
+    )
+
+
+def read_region(wav, start_fr, end_fr):
+    """samples [start_fr, end_fr) of a WavFile
+
+    16-bit PCM stays int16, which sf.write stores unchanged; other formats
+    are read as float64 like sf.read. Mono files give a 1-D array.
+    """
+    dtype = wav.dtype if wav.dtype == np.int16 else "float64"
+    audio = wav.read(start_fr, end_fr, dtype=dtype)
+    if wav.num_channels == 1:
+        return audio[:, 0]
+    return audio
+
+
+def mix(audios):
+    """add the others to the head of audios[0], one after another
+
+    int16 signals are summed as integers and clipped, which is what writing
+    their float sum to 16-bit PCM gives.
+    """
+    if all(audio.dtype == np.int16 for audio in audios):
+        mixed = audios[0].astype(np.int32)
+        for audio in audios[1:]:
+            mixed[: len(audio)] += audio
+        return np.clip(mixed, -32768, 32767).astype(np.int16)
+
+    audios = [x / 32768.0 if x.dtype == np.int16 else x for x in audios]
+    mixed = audios[0].copy()
+    for audio in audios[1:]:
+        mixed[: len(audio)] += audio
+    return mixed
+
+
+class SessionRecordings:
+    """far and near field recordings of an AliMeeting session, opened once"""
+
+    def __init__(self, ali_meeting_dir, subset, session):
+        far_files = get_audio_files(ali_meeting_dir, subset, session, "far")
+        assert len(far_files) == 1
+        self.far_wav = WavFile(far_files[0])
+
+        near_files = get_audio_files(ali_meeting_dir, subset, session, "near")
+        assert len(near_files) <= 4
+        near_wavs = [WavFile(audio_file) for audio_file in near_files]
+        self.spk_wavs = {}
+        for audio_file, wav in zip(near_files, near_wavs):
+            basename = os.path.basename(audio_file)
+            match = re.search(r"\w+_(N_SPK\d+).wav", basename)
+            if not match:
+                raise RuntimeError(f"Failed to parse {basename}")
+            spk = match.group(1)
+            assert wav.sample_rate == 16000
+            self.spk_wavs[spk] = wav
+
+        # the longest near field recording is the base of the mixture
+        max_dur = 0
+        max_dur_idx = 0
+        for i, wav in enumerate(near_wavs):
+            if len(wav) > max_dur:
+                max_dur = len(wav)
+                max_dur_idx = i
+        self.mix_wavs = [near_wavs[max_dur_idx]] + [
+            wav for i, wav in enumerate(near_wavs) if i != max_dur_idx
+        ]
+        self.near_sr = near_wavs[-1].sample_rate if len(near_wavs) > 0 else 16000
+
+
+def get_condition_audio(condition, recordings, one_session):
+    """samples and sample rate of one condition of a mini-session"""
+    start = one_session["start"]
+    end = one_session["end"]
+    if condition == "SDM":
+        sr = recordings.far_wav.sample_rate
         start_fr = int(start * sr)
         end_fr = int(end * sr)
-
-        if os.path.exists(out_wav):
-            print(f"{out_wav} exists, skip")
-        else:
-            sf.write(out_wav, audio[start_fr:end_fr, 0], sr)
-
-        time_fixed_data = fix_timing(data, start)
-        with open(out_json, "w", encoding="utf-8") as fp:
-            json.dump(time_fixed_data, fp, indent=4, ensure_ascii=False)
-
-
-def gen_ihm_mix(in_json, ali_meeting_dir, subset):
-    """generate mixture of independent head microphones"""
-    with open(in_json) as fp:
-        all_data = json.load(fp)
-
-    prev_session = ""
-    max_dur_idx = 0
-    sr = 16000
-    for one_session in all_data:
-        session = one_session["session"]
-        data = one_session["data"]
-        start = one_session["start"]
-        end = one_session["end"]
-
-        # create IHM-MIX
-        if prev_session != session:
-            if subset == "dev":
-                audio_files = glob.glob(
-                    f"{ali_meeting_dir}/Eval_Ali/Eval_Ali_near/audio_dir/{session}_*.wav"
-                )
-            elif subset == "test":
-                audio_files = glob.glob(
-                    f"{ali_meeting_dir}/Test_Ali/Test_Ali_near/audio_dir/{session}_*.wav"
-                )
-            assert len(audio_files) <= 4
-
-            audios = []
-            max_dur = 0
-            max_dur_idx = 0
-            for i, audio_file in enumerate(audio_files):
-                audio, sr = sf.read(audio_file)
-                audios.append(audio)
-                if len(audio) > max_dur:
-                    max_dur = len(audio)
-                    max_dur_idx = i
-            for i in range(len(audios)):
-                if i != max_dur_idx:
-                    audios[max_dur_idx][: len(audios[i])] += audios[i]
-        prev_session = session
-
-        out_wav = f"{ROOT_DIR}/IHM-MIX/{subset}/{session}-{start}-{end}.wav"
-        out_json = f"{ROOT_DIR}/IHM-MIX/{subset}/{session}-{start}-{end}.json"
-        mkdir = os.path.dirname(out_wav)
-        if not os.path.exists(mkdir):
-            os.makedirs(mkdir, exist_ok=True)
-
+        return read_region(recordings.far_wav, start_fr, end_fr)[:, 0], sr
+    if condition == "IHM-MIX":
+        sr = recordings.near_sr
         start_fr = int(start * sr)
         end_fr = int(end * sr)
-
-        if os.path.exists(out_wav):
-            print(f"{out_wav} exists, skip")
-        else:
-            sf.write(out_wav, audios[max_dur_idx][start_fr:end_fr], sr)
-
-        time_fixed_data = fix_timing(data, start)
-        with open(out_json, "w", encoding="utf-8") as fp:
-            json.dump(time_fixed_data, fp, indent=4, ensure_ascii=False)
+        audios = [read_region(wav, start_fr, end_fr) for wav in recordings.mix_wavs]
+        return mix(audios), sr
+    if condition == "IHM-CAT":
+        sr = 16000
+        audio_to_concate = []
+        for elem in one_session["data"]:
+            start_fr = int(elem["start"] * sr)
+            end_fr = int(elem["end"] * sr)
+            wav = recordings.spk_wavs[elem["speaker"]]
+            audio_to_concate.append(read_region(wav, start_fr, end_fr))
+        return np.concatenate(audio_to_concate), sr
+    raise ValueError(f"Unknown condition {condition}")
+
+
+def get_condition_data(condition, one_session):
+    """annotation of one condition of a mini-session, in its own timeline"""
+    if condition == "IHM-CAT":
+        return concat_timing(one_session["data"])
+    return fix_timing(copy.deepcopy(one_session["data"]), one_session["start"])
+
+
+def gen_session(job):
+    """generate SDM, IHM-MIX and IHM-CAT data of the mini-sessions of a session
+
+    Every recording of the session is opened once and only the regions of
+    the mini-sessions are read.
+    """
+    ali_meeting_dir, subset, session, mini_sessions = job
+    recordings = SessionRecordings(ali_meeting_dir, subset, session)
+
+    for one_session in mini_sessions:
+        name = f"{session}-{one_session['start']}-{one_session['end']}"
+        for condition in CONDITIONS:
+            out_wav = f"{ROOT_DIR}/{condition}/{subset}/{name}.wav"
+            out_json = f"{ROOT_DIR}/{condition}/{subset}/{name}.json"
+            if os.path.exists(out_wav):
+                print(f"{out_wav} exists, skip")
+            else:
+                audio, sr = get_condition_audio(condition, recordings, one_session)
+                sf.write(out_wav, audio, sr)
+
+            with open(out_json, "w", encoding="utf-8") as fp:
+                json.dump(
+                    get_condition_data(condition, one_session),
+                    fp,
+                    indent=4,
+                    ensure_ascii=False,
+                )
+    return session
 
 
-def gen_ihm_cat(in_json, ali_meeting_dir, subset):
-    """generate concat of independent head microphones"""
+def gen_subset(in_json, ali_meeting_dir, subset, num_workers=1):
+    """generate all conditions of a subset, one session per job"""
     with open(in_json) as fp:
         all_data = json.load(fp)
 
-    prev_session = ""
+    sessions = {}
     for one_session in all_data:
-        session = one_session["session"]
-        data = one_session["data"]
-        session_start = one_session["start"]
-        session_end = one_session["end"]
-
-        if prev_session != session:
-            if subset == "dev":
-                audio_files = glob.glob(
-                    f"{ali_meeting_dir}/Eval_Ali/Eval_Ali_near/audio_dir/{session}_*.wav"
-                )
-            elif subset == "test":
-                audio_files = glob.glob(
-                    f"{ali_meeting_dir}/Test_Ali/Test_Ali_near/audio_dir/{session}_*.wav"
-                )
-            assert len(audio_files) <= 4
-
-            sr = 16000
-            audios = {}
-            for i, audio_file in enumerate(audio_files):
-                basename = os.path.basename(audio_file)
-                match = re.search(r"\w+_(N_SPK\d+).wav", basename)
-                if not match:
-                    raise RuntimeError(f"Failed to parse {basename}")
-                spk = match.group(1)
-                audio, sr = sf.read(audio_file)
-                assert sr == 16000
-                audios[spk] = audio
-
-        audio_to_concate = []
-        for i, elem in enumerate(data):
-            spk = elem["speaker"]
-            start_fr = int(elem["start"] * sr)
-            end_fr = int(elem["end"] * sr)
-            audio_to_concate.append(audios[spk][start_fr:end_fr])
-        audio = np.concatenate(audio_to_concate)
-
-        new_data = []
-        new_start = 0
-        new_end = 0
-        for elem in data:
-            start = elem["start"]
-            end = elem["end"]
-            new_start = new_end
-            new_end = new_start + end - start
-            new_data.append(
-                {
-                    "speaker": elem["speaker"],
-                    "start": new_start,
-                    "end": new_end,
-                    "text": elem["text"],
-                    "translation": elem["translation"],
-                }
-            )
-
-        out_wav = (
-            f"{ROOT_DIR}/IHM-CAT/{subset}/{session}-{session_start}-{session_end}.wav"
-        )
-        out_json = (
-            f"{ROOT_DIR}/IHM-CAT/{subset}/{session}-{session_start}-{session_end}.json"
-        )
-        mkdir = os.path.dirname(out_wav)
-        if not os.path.exists(mkdir):
-            os.makedirs(mkdir, exist_ok=True)
+        sessions.setdefault(one_session["session"], []).append(one_session)
+    jobs = [
+        (ali_meeting_dir, subset, session, mini_sessions)
+        for session, mini_sessions in sessions.items()
+    ]
 
-        if os.path.exists(out_wav):
-            print(f"{out_wav} exists, skip")
-        else:
-            sf.write(out_wav, audio, sr)
+    for condition in CONDITIONS:
+        os.makedirs(f"{ROOT_DIR}/{condition}/{subset}", exist_ok=True)
 
-        with open(out_json, "w", encoding="utf-8") as fp:
-            json.dump(new_data, fp, indent=4, ensure_ascii=False)
+    if num_workers <= 1:
+        for job in jobs:
+            print(f"Generated {gen_session(job)}")
+    else:
+        with mp.Pool(num_workers) as pool:
+            for session in pool.imap_unordered(gen_session, jobs):
+                print(f"Generated {session}")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print(f"Usage: {sys.argv[0]} <ali_meeting_dir>")
+    if len(sys.argv) not in [2, 3]:
+        print(f"Usage: {sys.argv[0]} <ali_meeting_dir> [num_workers]")
         sys.exit(1)
 
     ALI_MEETING_DIR = sys.argv[1]
+    NUM_WORKERS = int(sys.argv[2]) if len(sys.argv) == 3 else os.cpu_count()
 
     for subset in SUBSETS:
         json_file = f"{ROOT_DIR}/{subset}.json"
 
-        gen_sdm(json_file, ALI_MEETING_DIR, subset)
-        gen_ihm_mix(json_file, ALI_MEETING_DIR, subset)
-        gen_ihm_cat(json_file, ALI_MEETING_DIR, subset)
+        gen_subset(json_file, ALI_MEETING_DIR, subset, NUM_WORKERS)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import time
+import resource
+from contextlib import contextmanager, nullcontext
+from collections import defaultdict
+
+# stages that launch CUDA kernels on the thread that runs the models; the
+# load, vad and write spans may run on the background threads of
+# `run_pipeline`, where a synchronize would wait for the kernels of the
+# processing thread and serialize the overlap
+SYNC_STAGES = ("embedding", "clustering", "st")
+
+
+def _sync_cuda():
+    # CUDA kernels run asynchronously, so wait for them to end the span
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_initialized():
+        torch.cuda.synchronize()
+
+
+class Trace:
+    """time spent in each stage of processing one file"""
+
+    def __init__(self, name):
+        self.name = str(name)
+        self.stages = defaultdict(float)
+        self.audio_sec = 0.0
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if stage in SYNC_STAGES:
+                _sync_cuda()
+            self.stages[stage] += time.perf_counter() - start
+
+
+class _NullTrace:
+    """a Trace that records nothing"""
+
+    name = ""
+    audio_sec = 0.0
+    _span = nullcontext()
+
+    def span(self, stage):
+        return self._span
+
+
+NULL_TRACE = _NullTrace()
+
+
+class Profiler:
+    """opt-in per-file stage timings, written as one JSON line per file
+
+    Each line holds the seconds spent in every stage, the seconds of audio,
+    and the peak memory of the process so far. Workers of a pool append to
+    the same `trace_file`, and `summary` reads it back. A disabled profiler
+    (empty `trace_file`) hands out `NULL_TRACE`, whose spans do nothing.
+    """
+
+    def __init__(self, trace_file=""):
+        self.trace_file = trace_file
+        self.enabled = trace_file != ""
+
+    def start(self):
+        """truncate the trace file at the start of a run"""
+        if self.enabled:
+            open(self.trace_file, "w").close()
+
+    def trace(self, name):
+        return Trace(name) if self.enabled else NULL_TRACE
+
+    def finish(self, trace):
+        """append the record of a file to the trace file"""
+        if not self.enabled:
+            return
+        record = {
+            "file": trace.name,
+            "audio_sec": trace.audio_sec,
+            "stages": dict(trace.stages),
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_initialized():
+            record["peak_cuda_mb"] = torch.cuda.max_memory_allocated() / 2**20
+        with open(self.trace_file, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def summary(self, wall_sec=None):
+        """print the real time factor and the share of each stage"""
+        if not self.enabled:
+            return
+        with open(self.trace_file) as f:
+            records = [json.loads(line) for line in f]
+        stages = defaultdict(float)
+        for record in records:
+            for stage, sec in record["stages"].items():
+                stages[stage] += sec
+        audio_sec = sum(record["audio_sec"] for record in records)
+        busy_sec = sum(stages.values())
+
+        print(f"Profiled {len(records)} files, trace in {self.trace_file}")
+        if audio_sec > 0:
+            line = f"  {audio_sec:.1f}s of audio, RTF {busy_sec / audio_sec:.3f}"
+            if wall_sec is not None:
+                line += f" (wall clock {wall_sec / audio_sec:.3f})"
+            print(line)
+        for stage, sec in sorted(stages.items(), key=lambda x: -x[1]):
+            share = 100 * sec / busy_sec if busy_sec > 0 else 0.0
+            print(f"  {stage:<12} {sec:9.2f}s {share:5.1f}%")
+        if len(records) > 0:
+            line = f"  peak RSS {max(r['peak_rss_mb'] for r in records):.0f} MB"
+            peak_cuda = [r["peak_cuda_mb"] for r in records if "peak_cuda_mb" in r]
+            if len(peak_cuda) > 0:
+                line += f", peak CUDA {max(peak_cuda):.0f} MB"
+            print(line)
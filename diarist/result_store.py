@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import json
+import fcntl
+
+import fire
+
+
+class ResultStore:
+    """single-file store of the TSV result lines of many sessions
+
+    Every `put` appends one JSON line {"session": ..., "lines": [...]}; a
+    later entry of a session replaces the earlier ones. The index from
+    session to the offset of its latest entry is built by reading the file
+    once and is extended as the file grows, so a session is read with a
+    single seek. Appends are locked, so several processes can write to the
+    same store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = {}
+        self.size = 0
+        self.refresh()
+
+    def refresh(self):
+        """index the entries appended since the last refresh"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self.size)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # being written
+                entry = json.loads(line)
+                self.index[entry["session"]] = self.size
+                self.size += len(line)
+
+    def __contains__(self, session):
+        return session in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def sessions(self):
+        return sorted(self.index)
+
+    def get(self, session):
+        """non-empty result lines of a session"""
+        with open(self.path, "rb") as f:
+            f.seek(self.index[session])
+            return json.loads(f.readline())["lines"]
+
+    def items(self):
+        """(session, lines) of all sessions, in session order"""
+        with open(self.path, "rb") as f:
+            for session in self.sessions():
+                f.seek(self.index[session])
+                yield session, json.loads(f.readline())["lines"]
+
+    def put(self, session, lines):
+        """store the result lines of a session, e.g. the output of `process_one_sample`"""
+        lines = [line for line in lines if line not in [" ", ""]]
+        entry = json.dumps({"session": session, "lines": lines}, ensure_ascii=False)
+        data = f"{entry}\n".encode("utf-8")
+        out_dir = os.path.dirname(self.path)
+        if out_dir != "":
+            os.makedirs(out_dir, exist_ok=True)
+        with open(self.path, "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(data)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        if offset == self.size:
+            # nothing was appended by others since the last refresh
+            self.index[session] = offset
+            self.size += len(data)
+        else:
+            self.refresh()
+
+
+def session_name(out_tsv):
+    """store key of a result, i.e. the name of its tsv file without extension"""
+    return os.path.splitext(os.path.basename(str(out_tsv)))[0]
+
+
+def import_tsv(store, tsv_dir):
+    """add all tsv files under tsv_dir to the store"""
+    result_store = ResultStore(store)
+    for tsv in sorted(glob.glob(f"{tsv_dir}/**/*.tsv", recursive=True)):
+        with open(tsv, "r") as f:
+            result_store.put(session_name(tsv), f.read().split("\n"))
+    print(f"{store} holds {len(result_store)} sessions")
+
+
+def export_tsv(store, out_dir):
+    """write the results of the store as one tsv file per session"""
+    os.makedirs(out_dir, exist_ok=True)
+    for session, lines in ResultStore(store).items():
+        with open(os.path.join(out_dir, f"{session}.tsv"), "w", encoding="utf-8") as f:
+            for line in lines:
+                f.write(f"{line}\n")
+
+
+def main():
+    fire.Fire({"import": import_tsv, "export": export_tsv})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+from diarist.scoring.stats import extract, segment_statistics, compute_score
+
+
+def pair_statistics(bleu, hyp_texts, ref_texts):
+    """sufficient statistics of every (hyp speaker, ref speaker) pair
+
+    Each speaker stream is tokenized once. `stats[h][r]` holds the
+    statistics of `hyp_texts[h]` scored against `ref_texts[r]`.
+    """
+    hyps = [extract(bleu, text) for text in hyp_texts]
+    refs = [extract(bleu, text) for text in ref_texts]
+    return [[segment_statistics(hyp, ref) for ref in refs] for hyp in hyps]
+
+
+class _Problem:
+    """speaker mapping problem over a square matrix of pair statistics
+
+    Every hypothesis and reference stream is used exactly once in any
+    mapping, so the lengths and n-gram totals of the corpus are fixed and
+    only the n-gram matches depend on the mapping. BLEU is non-decreasing in
+    each match count, which gives the bound used by the exact search.
+    """
+
+    def __init__(self, bleu, pair_stats):
+        self.bleu = bleu
+        self.n = len(pair_stats)
+        self.order = bleu.max_ngram_order
+        order = self.order
+        self.matches = [[stats[2 : 2 + order] for stats in row] for row in pair_stats]
+        hyp_len = sum(row[0][0] for row in pair_stats)
+        ref_len = sum(stats[1] for stats in pair_stats[0])
+        total = [sum(row[0][2 + order + k] for row in pair_stats) for k in range(order)]
+        self.prefix = [hyp_len, ref_len]
+        self.total = total
+
+    def score(self, correct):
+        return compute_score(self.bleu, self.prefix + list(correct) + self.total)
+
+    def correct(self, perm):
+        correct = [0] * self.order
+        for r, h in enumerate(perm):
+            for k, m in enumerate(self.matches[h][r]):
+                correct[k] += m
+        return correct
+
+    def upper_bound(self, pos, used, correct):
+        """score bound of any mapping extending a partial one over refs [0, pos)"""
+        free = [h for h in range(self.n) if not used[h]]
+        bound = list(correct)
+        for k in range(self.order):
+            by_ref = 0
+            for r in range(pos, self.n):
+                by_ref += max(self.matches[h][r][k] for h in free)
+            by_hyp = 0
+            for h in free:
+                by_hyp += max(self.matches[h][r][k] for r in range(pos, self.n))
+            bound[k] += min(by_ref, by_hyp)
+        return self.score(bound)
+
+
+def _exact_search(problem):
+    """branch-and-bound over permutations in lexicographic order
+
+    Only strictly better mappings replace the incumbent, so ties resolve to
+    the lexicographically first permutation, exactly like enumerating
+    `itertools.permutations`.
+    """
+    n = problem.n
+    used = [False] * n
+    perm = []
+    correct = [0] * problem.order
+    best = {"perm": None, "score": -1.0}
+
+    def visit(pos):
+        if pos == n:
+            score = problem.score(correct)
+            if score > best["score"]:
+                best["score"] = score
+                best["perm"] = tuple(perm)
+            return
+        if best["perm"] is not None:
+            if problem.upper_bound(pos, used, correct) <= best["score"]:
+                return
+        for h in range(n):
+            if used[h]:
+                continue
+            m = problem.matches[h][pos]
+            used[h] = True
+            perm.append(h)
+            for k in range(problem.order):
+                correct[k] += m[k]
+            visit(pos + 1)
+            for k in range(problem.order):
+                correct[k] -= m[k]
+            perm.pop()
+            used[h] = False
+
+    visit(0)
+    return best["perm"], best["score"]
+
+
+def _approximate_search(problem, max_iters):
+    """greedy mapping refined by pairwise swaps, at most `max_iters` sweeps"""
+    n = problem.n
+    perm = []
+    used = [False] * n
+    correct = [0] * problem.order
+    for r in range(n):
+        best_h, best_score = -1, -1.0
+        for h in range(n):
+            if used[h]:
+                continue
+            cand = [c + m for c, m in zip(correct, problem.matches[h][r])]
+            score = problem.score(cand)
+            if score > best_score:
+                best_h, best_score = h, score
+        used[best_h] = True
+        perm.append(best_h)
+        correct = [c + m for c, m in zip(correct, problem.matches[best_h][r])]
+
+    best_score = problem.score(correct)
+    for _ in range(max_iters):
+        improved = False
+        for i in range(n - 1):
+            for j in range(i + 1, n):
+                perm[i], perm[j] = perm[j], perm[i]
+                score = problem.score(problem.correct(perm))
+                if score > best_score:
+                    best_score = score
+                    improved = True
+                else:
+                    perm[i], perm[j] = perm[j], perm[i]
+        if not improved:
+            break
+    return tuple(perm), best_score
+
+
+def best_assignment(bleu, pair_stats, max_exact_speakers=10, max_iters=100):
+    """find the speaker mapping that maximizes corpus BLEU
+
+    `pair_stats` must be square (pad the shorter side with empty streams).
+    Returns `(perm, score)` where `perm[r]` is the hypothesis index mapped to
+    reference `r`. Up to `max_exact_speakers` speakers the result is exact and
+    identical to scoring every permutation; beyond that a bounded
+    approximate search is used.
+    """
+    problem = _Problem(bleu, pair_stats)
+    if problem.n > max_exact_speakers:
+        print(
+            f"Num of speakers is larger than {max_exact_speakers}, "
+            "falling back to approximate speaker mapping."
+        )
+        return _approximate_search(problem, max_iters)
+    return _exact_search(problem)
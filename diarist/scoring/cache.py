@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+
+from sacrebleu.metrics import BLEU
+
+from diarist.scoring.ref_index import file_hash
+
+CACHE_VERSION = 1
+
+
+class ScoreCache:
+    """per-session scores and BLEU statistics keyed by hyp and ref file hashes
+
+    A cached entry holds the output of `session_statistics`, i.e. the session
+    BLEU and the sufficient statistics of both metrics, including those of the
+    best SAtBLEU speaker mapping. With an empty `cache_file` the cache only
+    lives in memory.
+    """
+
+    def __init__(self, cache_file=""):
+        self.cache_file = cache_file
+        self.signature = f"v{CACHE_VERSION}|{BLEU().tokenizer_signature}"
+        self.sessions = {}
+        self.used = set()
+        if cache_file != "" and os.path.exists(cache_file):
+            with open(cache_file, "r") as f:
+                cache = json.load(f)
+            if cache.get("signature") == self.signature:
+                self.sessions = cache["sessions"]
+            else:
+                print(f"{cache_file} was created with other settings, ignore it.")
+
+    @staticmethod
+    def key(hyp, ref_path):
+        """`hyp` is a tsv file or a (tsv name, lines) pair of a `ResultStore`"""
+        if isinstance(hyp, tuple):
+            text = "".join(f"{line}\n" for line in hyp[1])
+            hyp_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        else:
+            hyp_hash = file_hash(hyp)
+        return f"{hyp_hash}:{file_hash(ref_path)}"
+
+    def get(self, key):
+        self.used.add(key)
+        return self.sessions.get(key)
+
+    def put(self, key, result):
+        self.used.add(key)
+        self.sessions[key] = result
+
+    def save(self):
+        """write entries used by the last run, dropping stale ones"""
+        self.sessions = {k: v for k, v in self.sessions.items() if k in self.used}
+        self.used = set()
+        if self.cache_file == "":
+            return
+        tmp_file = f"{self.cache_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"signature": self.signature, "sessions": self.sessions}, f)
+        os.replace(tmp_file, self.cache_file)
@@ -1,119 +1,236 @@
 #!/usr/bin/env python3
 
 import os
-import json
-import itertools
-from collections import defaultdict
+import time
+from functools import partial
+from multiprocessing import Pool
 
 from sacrebleu.metrics import BLEU
 import numpy as np
 import fire
 
+from diarist.result_store import ResultStore
+from diarist.profiling import Profiler, NULL_TRACE
+from diarist.scoring.assignment import pair_statistics, best_assignment
+from diarist.scoring.cache import ScoreCache
+from diarist.scoring.ref_index import open_ref_index
+from diarist.scoring.session import (
+    reference_path,
+    load_reference,
+    load_hypothesis,
+    reference_texts,
+    hypothesis_texts,
+    extract_streams,
+    session_statistics,
+)
+from diarist.scoring.stats import extract, sum_statistics, compute_score
+
 
 def sagbleu(preds, ref_json, delimiter="\t"):
-    preds = [" ".join(d.split(delimiter)[3:]) for d in preds]
-    refs = [d["translation"] for d in ref_json]
-    pred = " ".join(preds)  # form a long sequence
-    ref = " ".join(refs)
+    pred, _ = hypothesis_texts(preds, delimiter)  # form a long sequence
+    ref, _ = reference_texts(ref_json)
 
     bleu = BLEU(effective_order=True)
     session_bleu = bleu.corpus_score([pred], [[ref]]).score
     return [pred], [ref], session_bleu
 
 
-def satbleu(preds, ref_json, delimiter="\t"):
-    spk2chunk_ref = defaultdict(list)
-    spk2chunk_hyp = defaultdict(list)
-    for seg in ref_json:
-        seg_spk = seg["speaker"]
-        spk2chunk_ref[seg_spk].append(seg["translation"])
-    for chunk in preds:
-        spk = chunk.split(delimiter)[0]
-        hyp = " ".join(chunk.split(delimiter)[3:])
-        spk2chunk_hyp[spk].append(hyp)
+def satbleu(preds, ref_json, delimiter="\t", max_exact_speakers=10):
+    _, ref_texts = reference_texts(ref_json)
+    _, hyp_texts = hypothesis_texts(preds, delimiter)
     bleu = BLEU()
 
-    ref_spks = list(spk2chunk_ref.keys())
-    hyp_spks = list(spk2chunk_hyp.keys())
+    list_len = max(len(ref_texts), len(hyp_texts))
+    ref_texts = ref_texts + [""] * (list_len - len(ref_texts))
+    hyp_texts = hyp_texts + [""] * (list_len - len(hyp_texts))
 
-    list_len = max(len(ref_spks), len(hyp_spks))
-    if list_len > 6:
-        print(
-            "Num of predicted speakers is larger than 6, evaluating this sample will be slow. "
-        )
-    perms = list(itertools.permutations(range(list_len)))
-    if len(ref_spks) < len(hyp_spks):
-        ref_texts = [" ".join(spk_txt) for spk, spk_txt in spk2chunk_ref.items()] + [
-            ""
-        ] * (len(hyp_spks) - len(ref_spks))
-        hyp_texts = [" ".join(spk_txt) for spk, spk_txt in spk2chunk_hyp.items()]
-
-    elif len(ref_spks) > len(hyp_spks):
-        ref_texts = [" ".join(spk_txt) for spk, spk_txt in spk2chunk_ref.items()]
-        hyp_texts = [" ".join(spk_txt) for spk, spk_txt in spk2chunk_hyp.items()] + [
-            ""
-        ] * (len(ref_spks) - len(hyp_spks))
-
-    elif len(ref_spks) == len(hyp_spks):
-        ref_texts = [" ".join(spk_txt) for spk, spk_txt in spk2chunk_ref.items()]
-        hyp_texts = [" ".join(spk_txt) for spk, spk_txt in spk2chunk_hyp.items()]
-
-    max_perm = perms[0]
-    max_score = bleu.corpus_score([hyp_texts[j] for j in max_perm], [ref_texts]).score
-
-    for i, perm in enumerate(perms[1:]):
-        score = bleu.corpus_score([hyp_texts[j] for j in perm], [ref_texts]).score
-        if score > max_score:
-            max_score = score
-            max_perm = perm
+    pair_stats = pair_statistics(bleu, hyp_texts, ref_texts)
+    max_perm, max_score = best_assignment(
+        bleu, pair_stats, max_exact_speakers=max_exact_speakers
+    )
     return [hyp_texts[j] for j in max_perm], ref_texts, max_score
 
 
-def evaluate(ref_dir, hyp_dir):
-    full_path_list = [
-        os.path.join(hyp_dir, f) for f in os.listdir(hyp_dir) if f.endswith(".tsv")
-    ]
-    print(f"Found {len(full_path_list)} files in {hyp_dir}")
+EVAL_METHODS = ["SAgBLEU", "SAtBLEU"]
 
-    for eval_method in ["SAgBLEU", "SAtBLEU"]:
-        dir_scores = {
-            "details": {},
-        }
-
-        total_hyps, total_refs = [], []
-        for dname in full_path_list:
-            # assume parallel dir structure, search for ref file in `ref_dir`
 
-            just_name = os.path.splitext(os.path.basename(dname))[0]
-            ref_json_path = os.path.join(ref_dir, f"{just_name}.json")
+def hyp_name(hyp):
+    return hyp[0] if isinstance(hyp, tuple) else hyp
 
-            with open(ref_json_path, "r") as f:
-                ref_json = json.load(f)
 
-            with open(dname, "r") as f:
-                preds = f.read().split("\n")
+def score_session(hyp, ref_dir, ref_index="", profiler=None):
+    """compute all metrics of one session along with their corpus statistics
 
-            preds = [p for p in preds if p not in [" ", ""]]
-            if eval_method == "SAtBLEU":
-                hyp, ref, session_bleu = satbleu(preds, ref_json)
-            elif eval_method == "SAgBLEU":
-                hyp, ref, session_bleu = sagbleu(preds, ref_json)
-            else:
-                raise NotImplementedError
-            total_hyps.extend(hyp)
-            total_refs.extend(ref)
+    `hyp` is a hypothesis tsv file or a (tsv name, lines) pair of a `ResultStore`.
+    With a `Profiler`, the time of each stage is traced.
+    """
+    hyp_path = hyp_name(hyp)
+    trace = profiler.trace(hyp_path) if profiler is not None else NULL_TRACE
+    with trace.span("load"):
+        preds = hyp[1] if isinstance(hyp, tuple) else load_hypothesis(hyp)
+    just_name = os.path.splitext(os.path.basename(hyp_path))[0]
+    ref_json_path = reference_path(hyp_path, ref_dir)
 
-            dir_scores["details"].update({dname: {"session_bleu": session_bleu,}})
+    bleu = BLEU()
+    ref_streams = None
+    if ref_index != "":
+        with trace.span("ref_index"):
+            index = open_ref_index(ref_index)
+            ref_streams = index.reference_streams(just_name, ref_json_path)
+        extract_fn = index.extract
+    if ref_streams is None:
+        extract_fn = extract
+        with trace.span("load"):
+            ref_json = load_reference(ref_json_path)
+        with trace.span("extract"):
+            ref_streams = extract_streams(bleu, reference_texts(ref_json), extract_fn)
+
+    with trace.span("extract"):
+        hyp_streams = extract_streams(bleu, hypothesis_texts(preds), extract_fn)
+    with trace.span("assignment"):
+        result = session_statistics(bleu, hyp_streams, ref_streams)
+    if profiler is not None:
+        profiler.finish(trace)
+    return hyp_path, result
+
+
+def score_sessions(
+    hyp_path_list, ref_dir, num_workers=1, ref_index="", cache=None, profiler=None
+):
+    """session results of all hypotheses (see `score_session`), reusing cached ones"""
+    results = {}
+    keys = {}
+    todo = []
+    for hyp in hyp_path_list:
+        hyp_path = hyp_name(hyp)
+        if cache is not None:
+            keys[hyp_path] = cache.key(hyp, reference_path(hyp_path, ref_dir))
+            cached = cache.get(keys[hyp_path])
+            if cached is not None:
+                results[hyp_path] = cached
+                continue
+        todo.append(hyp)
+
+    # each session is loaded once and scored for all metrics, possibly in
+    # parallel
+    worker = partial(
+        score_session, ref_dir=ref_dir, ref_index=ref_index, profiler=profiler
+    )
+    if num_workers > 1 and len(todo) > 1:
+        with Pool(num_workers) as pool:
+            new_results = list(pool.imap_unordered(worker, todo, chunksize=4))
+    else:
+        new_results = map(worker, todo)
+
+    for hyp_path, result in new_results:
+        results[hyp_path] = result
+        if cache is not None:
+            cache.put(keys[hyp_path], result)
+
+    if cache is not None:
+        cache.save()
+        print(f"Scored {len(todo)} new or changed files")
+    return results
+
+
+def corpus_scores(results):
+    """session and corpus level scores of all metrics from session results
+
+    Corpus BLEU is computed from the summed sufficient statistics, which is
+    identical to scoring all sessions with a single `corpus_score` call.
+    """
+    bleu = BLEU()
+    stats_size = 2 + 2 * bleu.max_ngram_order
+    all_scores = {}
+    for eval_method in EVAL_METHODS:
+        dir_scores = {
+            "details": {},
+        }
+        total_stats = [0] * stats_size
+        for dname, result in results.items():
+            session_result = result[eval_method]
+            dir_scores["details"].update(
+                {dname: {"session_bleu": session_result["session_bleu"],}}
+            )
+            total_stats = sum_statistics(
+                [total_stats, session_result["stats"]], stats_size
+            )
         avg_session_bleu = np.mean(
             [d["session_bleu"] for d in dir_scores["details"].values()]
         )
         dir_scores["avg_session_bleu"] = avg_session_bleu
 
-        bleu = BLEU()
-        lang_level_corpus_bleu = bleu.corpus_score(total_hyps, [total_refs]).score
+        lang_level_corpus_bleu = compute_score(bleu, total_stats)
         dir_scores["corpus_bleu"] = lang_level_corpus_bleu
-
-        print("{}: {:.2f}".format(eval_method, dir_scores["corpus_bleu"]))
+        all_scores[eval_method] = dir_scores
+    return all_scores
+
+
+def list_hypotheses(hyp_dir="", result_store=""):
+    """hypothesis tsv files of hyp_dir, or (tsv name, lines) pairs of a result store"""
+    if result_store != "":
+        return [(f"{s}.tsv", lines) for s, lines in ResultStore(result_store).items()]
+    return [os.path.join(hyp_dir, f) for f in os.listdir(hyp_dir) if f.endswith(".tsv")]
+
+
+def evaluate(
+    ref_dir,
+    hyp_dir="",
+    result_store="",
+    num_workers=1,
+    ref_index="",
+    cache_file="",
+    watch=False,
+    interval=10,
+    trace_file="",
+):
+    """score the tsv files of hyp_dir, or the results of a `ResultStore`
+
+    With `trace_file`, the time spent loading, extracting n-grams and
+    finding the best speaker assignment of each session is written there
+    as JSON lines and summarized after scoring.
+    """
+    if (hyp_dir == "") == (result_store == ""):
+        raise ValueError("Either hyp_dir or result_store must be set.")
+    profiler = Profiler(trace_file)
+    cache = None
+    if cache_file != "" or watch:
+        cache = ScoreCache(cache_file)
+
+    prev_state = None
+    try:
+        while True:
+            # in watch mode, rescore only when tsv files appear or change
+            if result_store != "":
+                # the watcher may start before the baseline creates the store
+                state = None
+                if os.path.exists(result_store) or not watch:
+                    st = os.stat(result_store)
+                    state = (st.st_mtime_ns, st.st_size)
+            else:
+                full_path_list = list_hypotheses(hyp_dir)
+                state = sorted(
+                    (f, os.stat(f).st_mtime_ns, os.stat(f).st_size)
+                    for f in full_path_list
+                )
+            if state != prev_state:
+                if result_store != "":
+                    full_path_list = list_hypotheses(result_store=result_store)
+                print(f"Found {len(full_path_list)} files in {hyp_dir or result_store}")
+                profiler.start()
+                results = score_sessions(
+                    full_path_list, ref_dir, num_workers, ref_index, cache, profiler
+                )
+                profiler.summary()
+                for eval_method, dir_scores in corpus_scores(results).items():
+                    print("{}: {:.2f}".format(eval_method, dir_scores["corpus_bleu"]))
+            prev_state = state
+
+            if not watch:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
 
 
 def main():
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import json
+import hashlib
+
+from sacrebleu.metrics import BLEU
+import numpy as np
+import fire
+
+from diarist.scoring.session import reference_texts
+
+INDEX_VERSION = 1
+META_FILE = "meta.json"
+ARRAYS = ["lengths", "offsets", "keys", "counts"]
+
+_opened = {}
+
+
+def file_hash(path):
+    """sha1 of a file"""
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def encode_ngrams(ids, base, max_order):
+    """per-order unique n-gram keys and counts of token ids
+
+    Each n-gram is packed into one int64 key in base `base`.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    ngrams = []
+    for n in range(1, max_order + 1):
+        num = max(0, len(ids) - n + 1)
+        keys = np.zeros(num, dtype=np.int64)
+        for i in range(n):
+            keys = keys * base + ids[i : i + num]
+        ngrams.append(np.unique(keys, return_counts=True))
+    return ngrams
+
+
+class RefIndex:
+    """memory-mapped reference streams of a ref dir built by `build_ref_index`
+
+    Token n-grams are packed into int64 keys over the reference vocabulary;
+    hypothesis tokens unseen in the references get an id that never matches.
+    """
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, META_FILE), "r") as f:
+            meta = json.load(f)
+        if meta["version"] != INDEX_VERSION:
+            raise ValueError(f"{index_dir} has unsupported version {meta['version']}")
+        bleu = BLEU()
+        if meta["tokenizer"] != bleu.tokenizer_signature:
+            raise ValueError(
+                f"{index_dir} was built with tokenizer {meta['tokenizer']}, "
+                f"but {bleu.tokenizer_signature} is used"
+            )
+        self.max_order = meta["max_ngram_order"]
+        self.sessions = meta["sessions"]
+        self.vocab = {tok: i for i, tok in enumerate(meta["vocab"])}
+        self.base = len(self.vocab) + 1
+        for name in ARRAYS:
+            path = os.path.join(index_dir, f"{name}.npy")
+            setattr(self, name, np.load(path, mmap_mode="r"))
+
+    def extract(self, bleu, text):
+        """same as `diarist.scoring.stats.extract`, with keys of this index"""
+        unk = self.base - 1
+        tokens = bleu._preprocess_segment(text).split()
+        ids = [self.vocab.get(tok, unk) for tok in tokens]
+        counts = [
+            dict(zip(keys.tolist(), cnt.tolist()))
+            for keys, cnt in encode_ngrams(ids, self.base, self.max_order)
+        ]
+        return counts, len(tokens)
+
+    def stream(self, idx):
+        """n-gram counts and length of the idx-th stored stream"""
+        offsets = self.offsets[idx]
+        counts = []
+        for n in range(self.max_order):
+            start, end = offsets[n], offsets[n + 1]
+            keys = self.keys[start:end].tolist()
+            counts.append(dict(zip(keys, self.counts[start:end].tolist())))
+        return counts, int(self.lengths[idx])
+
+    def reference_streams(self, name, ref_json_path):
+        """reference streams of a session, or None if it is missing or stale"""
+        session = self.sessions.get(name)
+        if session is None or session["hash"] != file_hash(ref_json_path):
+            print(f"{ref_json_path} is not in the reference index or has changed.")
+            return None
+        return (
+            self.stream(session["SAgBLEU"]),
+            [self.stream(idx) for idx in session["SAtBLEU"]],
+        )
+
+
+def open_ref_index(index_dir):
+    """open a reference index once per process"""
+    if index_dir not in _opened:
+        _opened[index_dir] = RefIndex(index_dir)
+    return _opened[index_dir]
+
+
+def build_ref_index(ref_dir, index_dir):
+    """compile every <session>.json in ref_dir into a reference index"""
+    bleu = BLEU()
+    max_order = bleu.max_ngram_order
+
+    # tokenize every reference stream and collect the vocabulary
+    vocab = {}
+    sessions = {}
+    streams = []
+    ref_json_list = sorted(glob.glob(os.path.join(ref_dir, "*.json")))
+    for ref_json_path in ref_json_list:
+        with open(ref_json_path, "rb") as f:
+            content = f.read()
+        ref, ref_spks = reference_texts(json.loads(content))
+
+        name = os.path.splitext(os.path.basename(ref_json_path))[0]
+        sessions[name] = {
+            "hash": hashlib.sha1(content).hexdigest(),
+            "SAgBLEU": len(streams),
+            "SAtBLEU": list(range(len(streams) + 1, len(streams) + 1 + len(ref_spks))),
+        }
+        for text in [ref] + ref_spks:
+            tokens = bleu._preprocess_segment(text).split()
+            streams.append([vocab.setdefault(tok, len(vocab)) for tok in tokens])
+
+    base = len(vocab) + 1
+    if base**max_order >= 2**63:
+        raise ValueError(f"Vocabulary of {len(vocab)} tokens is too large to index.")
+
+    # pack n-gram counts of all streams into flat arrays
+    lengths = np.zeros(len(streams), dtype=np.int64)
+    offsets = np.zeros((len(streams), max_order + 1), dtype=np.int64)
+    keys, counts = [], []
+    pos = 0
+    for i, ids in enumerate(streams):
+        lengths[i] = len(ids)
+        for n, (uniq, cnt) in enumerate(encode_ngrams(ids, base, max_order)):
+            offsets[i, n] = pos
+            keys.append(uniq)
+            counts.append(cnt)
+            pos += len(uniq)
+        offsets[i, max_order] = pos
+    arrays = {
+        "lengths": lengths,
+        "offsets": offsets,
+        "keys": np.concatenate(keys) if keys else np.zeros(0, np.int64),
+        "counts": (np.concatenate(counts) if counts else np.zeros(0)).astype(np.int32),
+    }
+
+    os.makedirs(index_dir, exist_ok=True)
+    meta_path = os.path.join(index_dir, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for name in ARRAYS:
+        np.save(os.path.join(index_dir, f"{name}.npy"), arrays[name])
+    meta = {
+        "version": INDEX_VERSION,
+        "tokenizer": bleu.tokenizer_signature,
+        "max_ngram_order": max_order,
+        "vocab": sorted(vocab, key=vocab.get),
+        "sessions": sessions,
+    }
+    # meta is written last so a partially written index is never opened
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    print(f"Indexed {len(sessions)} sessions of {ref_dir} into {index_dir}")
+
+
+def main():
+    fire.Fire(build_ref_index)
+
+
+if __name__ == "__main__":
+    fire.Fire(build_ref_index)
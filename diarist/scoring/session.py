@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import os
+import json
+from collections import defaultdict
+
+from sacrebleu.metrics import BLEU
+
+from diarist.scoring.assignment import best_assignment
+from diarist.scoring.stats import segment_statistics, sum_statistics, compute_score
+
+
+def reference_path(hyp_path, ref_dir):
+    """reference json of a hypothesis tsv"""
+    # assume parallel dir structure, search for ref file in `ref_dir`
+    just_name = os.path.splitext(os.path.basename(hyp_path))[0]
+    return os.path.join(ref_dir, f"{just_name}.json")
+
+
+def load_reference(ref_json_path):
+    """load reference json of one session"""
+    with open(ref_json_path, "r") as f:
+        return json.load(f)
+
+
+def load_hypothesis(hyp_path):
+    """load non-empty hypothesis lines of one session"""
+    with open(hyp_path, "r") as f:
+        preds = f.read().split("\n")
+    return [p for p in preds if p not in [" ", ""]]
+
+
+def reference_texts(ref_json):
+    """SAgBLEU reference and SAtBLEU per-speaker references of a session"""
+    spk2chunk_ref = defaultdict(list)
+    for seg in ref_json:
+        spk2chunk_ref[seg["speaker"]].append(seg["translation"])
+    ref = " ".join([d["translation"] for d in ref_json])
+    return ref, [" ".join(spk_txt) for spk_txt in spk2chunk_ref.values()]
+
+
+def hypothesis_texts(preds, delimiter="\t"):
+    """SAgBLEU hypothesis and SAtBLEU per-speaker hypotheses of a session"""
+    spk2chunk_hyp = defaultdict(list)
+    texts = []
+    for chunk in preds:
+        fields = chunk.split(delimiter)
+        spk = fields[0]
+        hyp = " ".join(fields[3:])
+        spk2chunk_hyp[spk].append(hyp)
+        texts.append(hyp)
+    return " ".join(texts), [" ".join(spk_txt) for spk_txt in spk2chunk_hyp.values()]
+
+
+def extract_streams(bleu, texts, extract):
+    """apply `extract` to the output of `reference_texts` or `hypothesis_texts`"""
+    text, spk_texts = texts
+    return extract(bleu, text), [extract(bleu, t) for t in spk_texts]
+
+
+def session_statistics(bleu, hyp_streams, ref_streams, max_exact_speakers=10):
+    """session BLEU and corpus sufficient statistics of both metrics
+
+    Streams are the outputs of `extract_streams`; hypothesis and reference
+    streams must come from the same extractor.
+    """
+    order = bleu.max_ngram_order
+    stats_size = 2 + 2 * order
+    hyp, hyp_spks = hyp_streams
+    ref, ref_spks = ref_streams
+
+    # SAgBLEU
+    sag_stats = segment_statistics(hyp, ref)
+    sag_bleu = compute_score(BLEU(effective_order=True), sag_stats)
+
+    # SAtBLEU, padding the shorter side with empty streams
+    empty = ([{} for _ in range(order)], 0)
+    list_len = max(len(hyp_spks), len(ref_spks))
+    hyp_spks = hyp_spks + [empty] * (list_len - len(hyp_spks))
+    ref_spks = ref_spks + [empty] * (list_len - len(ref_spks))
+    pair_stats = [[segment_statistics(h, r) for r in ref_spks] for h in hyp_spks]
+    max_perm, sat_bleu = best_assignment(
+        bleu, pair_stats, max_exact_speakers=max_exact_speakers
+    )
+    sat_stats = sum_statistics(
+        [pair_stats[h][r] for r, h in enumerate(max_perm)], stats_size
+    )
+
+    return {
+        "SAgBLEU": {"session_bleu": sag_bleu, "stats": sag_stats},
+        "SAtBLEU": {"session_bleu": sat_bleu, "stats": sat_stats},
+    }
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import os
+
+from sacrebleu.metrics import BLEU
+import numpy as np
+import fire
+
+from diarist.scoring.eval import EVAL_METHODS, score_sessions
+from diarist.scoring.stats import compute_scores, compute_score
+
+
+def collect_statistics(ref_dir, hyp_dirs, num_workers=1, ref_index=""):
+    """per-session statistics of every system over their common sessions
+
+    Returns the session names and, for each metric, an array of shape
+    (num_systems, num_sessions, stats_size).
+    """
+    names = None
+    for hyp_dir in hyp_dirs:
+        dir_names = {f for f in os.listdir(hyp_dir) if f.endswith(".tsv")}
+        names = dir_names if names is None else names & dir_names
+    names = sorted(names)
+    print(f"Found {len(names)} sessions common to {len(hyp_dirs)} systems")
+
+    stats = {eval_method: [] for eval_method in EVAL_METHODS}
+    for hyp_dir in hyp_dirs:
+        hyp_path_list = [os.path.join(hyp_dir, name) for name in names]
+        results = score_sessions(hyp_path_list, ref_dir, num_workers, ref_index)
+        for eval_method in EVAL_METHODS:
+            stats[eval_method].append(
+                [results[p][eval_method]["stats"] for p in hyp_path_list]
+            )
+    return names, {k: np.array(v, dtype=np.int64) for k, v in stats.items()}
+
+
+def paired_bootstrap(stats, n_samples=1000, seed=12345):
+    """paired bootstrap resampling of sessions
+
+    `stats` has shape (num_systems, num_sessions, stats_size) and the first
+    system is the baseline. Every resample draws sessions with replacement,
+    shared by all systems, and the resampled corpus statistics of all
+    systems are obtained with one matrix product. Returns the resampled
+    scores of shape (num_systems, n_samples).
+    """
+    num_systems, num_sessions, stats_size = stats.shape
+    rng = np.random.default_rng(seed)
+    idxs = rng.integers(0, num_sessions, size=(n_samples, num_sessions))
+
+    # how often each session is drawn in each resample
+    weights = np.zeros((n_samples, num_sessions), dtype=np.int64)
+    np.add.at(weights, (np.arange(n_samples)[:, None], idxs), 1)
+
+    resampled = np.einsum("rs,ysk->yrk", weights, stats)
+    return compute_scores(resampled.reshape(-1, stats_size)).reshape(
+        num_systems, n_samples
+    )
+
+
+def estimate_ci(scores):
+    """mean and half width of the 95% confidence interval"""
+    scores = np.sort(scores)
+    lower_idx = len(scores) // 40
+    upper_idx = len(scores) - lower_idx - 1
+    return scores.mean(), 0.5 * (scores[upper_idx] - scores[lower_idx])
+
+
+def p_value(scores_bl, scores_sys, real_diff):
+    """p-value of an absolute score difference, as sacrebleu's paired-bs test"""
+    sample_diffs = np.abs(scores_sys - scores_bl)
+    stats = sample_diffs - sample_diffs.mean()
+    return (np.sum(stats > real_diff) + 1) / (len(stats) + 1)
+
+
+def compare(
+    ref_dir, *hyp_dirs, num_workers=1, ref_index="", n_samples=1000, seed=12345
+):
+    """compare systems to the first one (baseline) with paired bootstrap resampling"""
+    if len(hyp_dirs) < 2:
+        raise ValueError("At least two hyp dirs must be given.")
+
+    _, all_stats = collect_statistics(ref_dir, hyp_dirs, num_workers, ref_index)
+
+    bleu = BLEU()
+    for eval_method, stats in all_stats.items():
+        bs_scores = paired_bootstrap(stats, n_samples, seed)
+        scores = [compute_score(bleu, s.sum(axis=0).tolist()) for s in stats]
+
+        print(f"{eval_method} ({n_samples} resamples)")
+        for i, hyp_dir in enumerate(hyp_dirs):
+            mean, ci = estimate_ci(bs_scores[i])
+            line = f"  {hyp_dir}: {scores[i]:.2f} (μ = {mean:.2f} ± {ci:.2f})"
+            if i == 0:
+                line += " baseline"
+            else:
+                real_diff = abs(scores[i] - scores[0])
+                p = p_value(bs_scores[0], bs_scores[i], real_diff)
+                line += f" p = {p:.4f}"
+            print(line)
+
+
+def main():
+    fire.Fire(compare)
+
+
+if __name__ == "__main__":
+    fire.Fire(compare)
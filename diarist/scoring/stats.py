@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+from collections import Counter
+
+import numpy as np
+
+
+def ngram_counts(tokens, max_order=4):
+    """per-order n-gram counts of a token sequence"""
+    return [
+        Counter(tuple(tokens[i : i + n]) for i in range(len(tokens) - n + 1))
+        for n in range(1, max_order + 1)
+    ]
+
+
+def extract(bleu, text):
+    """tokenize a text as sacrebleu does and return its n-gram counts and length"""
+    tokens = bleu._preprocess_segment(text).split()
+    return ngram_counts(tokens, bleu.max_ngram_order), len(tokens)
+
+
+def match_counts(hyp_counts, ref_counts):
+    """clipped n-gram matches for each order"""
+    correct = []
+    for hyp_ngrams, ref_ngrams in zip(hyp_counts, ref_counts):
+        n_correct = 0
+        for ngram, count in hyp_ngrams.items():
+            ref_count = ref_ngrams.get(ngram)
+            if ref_count:
+                n_correct += min(count, ref_count)
+        correct.append(n_correct)
+    return correct
+
+
+def segment_statistics(hyp, ref):
+    """sacrebleu sufficient statistics of one (hyp, ref) pair from `extract` outputs
+
+    The layout is [hyp_len, ref_len, correct_1..N, total_1..N], the same as
+    `BLEU._compute_segment_statistics` with a single reference.
+    """
+    hyp_counts, hyp_len = hyp
+    ref_counts, ref_len = ref
+    correct = match_counts(hyp_counts, ref_counts)
+    total = [sum(c.values()) for c in hyp_counts]
+    return [hyp_len, ref_len] + correct + total
+
+
+def sum_statistics(stats_list, size):
+    """sum a list of sufficient statistics"""
+    total = [0] * size
+    for stats in stats_list:
+        for i in range(size):
+            total[i] += stats[i]
+    return total
+
+
+def compute_score(bleu, stats):
+    """BLEU score from aggregated sufficient statistics"""
+    return bleu._compute_score_from_stats(list(stats)).score
+
+
+def compute_scores(stats, max_order=4):
+    """vectorized `compute_score` of BLEU() over rows of a statistics array
+
+    Follows `BLEU.compute_bleu` with its default "exp" smoothing and without
+    effective order.
+    """
+    stats = np.asarray(stats, dtype=np.float64)
+    sys_len, ref_len = stats[:, 0], stats[:, 1]
+    correct = stats[:, 2 : 2 + max_order]
+    total = stats[:, 2 + max_order :]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bp = np.where(sys_len < ref_len, np.exp(1 - ref_len / sys_len), 1.0)
+        bp = np.where(sys_len > 0, bp, np.where(ref_len > 0, 0.0, 1.0))
+
+        # each order without matches halves the smoothed precision again
+        zero = correct == 0
+        smooth = np.power(2.0, np.cumsum(zero, axis=1))
+        precisions = np.where(zero, 100.0 / (smooth * total), 100.0 * correct / total)
+        log_precisions = np.log(precisions).sum(axis=1) / max_order
+        scores = bp * np.exp(log_precisions)
+
+    # no matches at all, or an order without any hypothesis n-gram
+    valid = zero.sum(axis=1) < max_order
+    valid &= (total > 0).all(axis=1)
+    return np.where(valid, scores, 0.0)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import os
+import struct
+
+import numpy as np
+
+# (format tag, bits per sample) -> sample dtype
+_DTYPES = {(1, 16): "<i2", (1, 32): "<i4", (3, 32): "<f4", (3, 64): "<f8"}
+_SCALES = {"<i2": 32768.0, "<i4": 2147483648.0}
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class WavFile:
+    """memory-mapped PCM (16/32-bit) or float wav file
+
+    The samples are mapped rather than read, so only the regions that are
+    accessed are loaded from disk. `read(start_fr, end_fr)` serves the
+    frames [start_fr, end_fr) of all channels.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+            if riff != b"RIFF" or wave_id != b"WAVE":
+                raise ValueError(f"{path} is not a wav file.")
+            fmt = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise ValueError(f"No data chunk in {path}.")
+                chunk_id, size = struct.unpack("<4sI", header)
+                if chunk_id == b"data":
+                    data_offset = f.tell()
+                    break
+                chunk = f.read(size + size % 2)
+                if chunk_id == b"fmt ":
+                    fmt = chunk
+        if fmt is None:
+            raise ValueError(f"No fmt chunk in {path}.")
+
+        format_tag, channels, sample_rate, _, _, bits = struct.unpack(
+            "<HHIIHH", fmt[:16]
+        )
+        if format_tag == _WAVE_FORMAT_EXTENSIBLE:
+            # the sub format GUID starts with the actual format tag
+            format_tag = struct.unpack("<H", fmt[24:26])[0]
+        if (format_tag, bits) not in _DTYPES:
+            raise ValueError(f"Unsupported wav format {format_tag}/{bits} in {path}.")
+
+        self.dtype = np.dtype(_DTYPES[(format_tag, bits)])
+        self.sample_rate = sample_rate
+        self.num_channels = channels
+        # the data size may be a placeholder for files that were not closed
+        data_size = min(size, os.path.getsize(path) - data_offset)
+        self.num_frames = data_size // (channels * self.dtype.itemsize)
+        if self.num_frames == 0:
+            self.samples = np.zeros((0, channels), dtype=self.dtype)
+        else:
+            self.samples = np.memmap(
+                path,
+                dtype=self.dtype,
+                mode="c",
+                offset=data_offset,
+                shape=(self.num_frames, channels),
+            )
+
+    def __len__(self):
+        return self.num_frames
+
+    def read(self, start_fr=0, end_fr=None, dtype="float32"):
+        """frames [start_fr, end_fr) of shape (frames, channels)
+
+        Float dtypes are scaled to [-1, 1) like soundfile does. The native
+        dtype (e.g. "int16" for 16-bit files) gives a view of the mapping.
+        """
+        samples = self.samples[start_fr:end_fr]
+        dtype = np.dtype(dtype)
+        if dtype == self.dtype:
+            return samples
+        if dtype.kind != "f":
+            raise ValueError(f"Cannot read {self.dtype} samples as {dtype}.")
+        if self.dtype.str in _SCALES:
+            return samples.astype(dtype) / dtype.type(_SCALES[self.dtype.str])
+        return samples.astype(dtype)
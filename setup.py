@@ -18,7 +18,16 @@ setup(
         "console_scripts": [
             "diarist_baseline_td=diarist.baseline.translate_and_diarize:main",
             "diarist_baseline_dt=diarist.baseline.diarize_and_translate:main",
-            "diarist_eval=diarist.scoring.eval:main"
+            "diarist_baseline_stream=diarist.baseline.streaming:main",
+            "diarist_service=diarist.baseline.service:main",
+            "diarist_st_cache=diarist.baseline.st_cache:main",
+            "diarist_snapshot=diarist.baseline.snapshot:main",
+            "diarist_clustering_agreement=diarist.baseline.clustering_agreement:main",
+            "diarist_result_store=diarist.result_store:main",
+            "diarist_eval=diarist.scoring.eval:main",
+            "diarist_ref_index=diarist.scoring.ref_index:main",
+            "diarist_compare=diarist.scoring.significance:main",
+            "diarist_benchmark=diarist.benchmark.suite:main",
         ]
     },
 )